@@ -35,6 +35,14 @@ def create_celery_app(config_name):
     app.config.from_object(config[config_name])
     mail.init_app(app)
     db.init_app(app)
+    # write only, lets tasks emit to clients connected to any web worker. The
+    # web app imports the tasks too, after it has set up socketio itself.
+    if socketio.server is None:
+        socketio.init_app(
+            None,
+            message_queue=app.config.get("SOCKETIO_MESSAGE_QUEUE"),
+            async_mode="threading",
+        )
 
     return app
 
@@ -58,6 +66,7 @@ def create_app(config_name):
         app,
         cors_allowed_origins=client,
         async_mode="eventlet",
+        message_queue=app.config.get("SOCKETIO_MESSAGE_QUEUE"),
         manage_session=False,
         engineio_logger=True,
     )
@@ -3,7 +3,7 @@ import logging
 from flask import Blueprint, session, request
 from flask_login import current_user
 
-from app import db
+from app.utils import last_seen
 from app.errors import (
     bad_request,
     conflict,
@@ -22,8 +22,8 @@ api = Blueprint("api", __name__, url_prefix="/api")
 @api.before_request
 def handle_before_request():
     if current_user.is_authenticated:
-        current_user.ping()
-        db.session.commit()
+        # written to the users in batches by the flush_last_seen task
+        last_seen.touch(current_user.id)
 
         if request.cookies.get("remember_token") is None:
             session.modified = True
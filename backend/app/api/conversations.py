@@ -1,11 +1,13 @@
 import logging
-from sqlalchemy import or_
+import uuid
 from flask import Blueprint, abort, jsonify, request
 from flask_login import current_user, login_required
+from marshmallow.exceptions import ValidationError
+from sqlalchemy import delete, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 
 from app import db
-from app.exceptions import ValidationError
 from app.models.conversation import Conversation
 from app.models.message import Message
 from app.serde import (
@@ -13,6 +15,7 @@ from app.serde import (
     MessageSchema,
     NewConversationSchema,
     Messages,
+    ReadMessagesSchema,
 )
 from app.utils import extract_all_errors
 
@@ -22,26 +25,112 @@ logger = logging.getLogger(__name__)
 conversations = Blueprint("conversations", __name__, url_prefix="/conversations")
 
 
+def _sent_message(message_id, conversation):
+    """The message the current user already sent with this id, if any"""
+    message = Message.query.get(message_id)
+    if message is None:
+        return None
+
+    if (
+        message.sender_id != current_user.id
+        or message.conversation_id != conversation.id
+    ):
+        abort(409, "Message id is already in use")
+    return message
+
+
+def post_message(conversation, payload):
+    """
+    Stores a message from the current user and notifies the other participant.
+    Shared by the HTTP route and the ``send_message`` socket event.
+
+    Clients may give the message its id. A send retried after its response
+    was lost then returns the stored message instead of storing it again.
+    """
+    if current_user.id not in (conversation.sender_id, conversation.recipient_id):
+        abort(400, "Conversation does not exist")
+
+    if not conversation.are_friends():
+        abort(400, "You cannot message this user as you are not friends")
+
+    try:
+        data = MessageSchema().load(payload)
+    except ValidationError as err:
+        abort(422, extract_all_errors(err))
+
+    message_id = data.get("id")
+    if message_id is not None:
+        sent = _sent_message(message_id, conversation)
+        if sent is not None:
+            return MessageSchema().dump(sent)
+
+    message = Message(
+        **data, sender_id=current_user.id, conversation_id=conversation.id
+    )
+    db.session.add(message)
+    conversation.record_message(message)
+    try:
+        db.session.commit()
+    except IntegrityError as err:
+        db.session.rollback()
+        # stored concurrently by a retry since the check above
+        if message_id is not None and err.orig.diag.constraint_name == "messages_pkey":
+            sent = _sent_message(message_id, conversation)
+            if sent is not None:
+                return MessageSchema().dump(sent)
+        raise
+
+    client_user_id = (
+        conversation.recipient_id
+        if current_user.id == conversation.sender_id
+        else conversation.sender_id
+    )
+    message_data = MessageSchema().dump(message)
+    event_data = {
+        "id": str(conversation.id),
+        "kind": "UPDATE",
+        "name": "conversation",
+        "message": message_data,
+    }
+
+    from websockets import send_event_to_client
+
+    send_event_to_client(event_data, client_user_id)
+
+    return message_data
+
+
 @conversations.route("", methods=["GET", "POST"])
 @login_required
 def get_or_create_conversations():
     if request.method == "GET":
+        page_size = request.args.get("limit")
+        if page_size:
+            page_size = int(page_size)
+
+        before = request.args.get("before")
+        if before:
+            before = datetime.fromisoformat(before)
+
+        before_id = request.args.get("beforeId")
+        if before_id:
+            try:
+                before_id = uuid.UUID(before_id)
+            except ValueError:
+                abort(400, "Invalid conversation id")
+
         data = [
             {
-                "messages": [
-                    MessageSchema().dump(message)
-                    for message in conversation.get_messages(current_user.id)
-                ],
+                "messages": MessageSchema(many=True).dump(messages),
+                "unreadCount": conversation.unread_count_for(current_user.id),
                 **ConversationSchema().dump(conversation),
             }
-            for conversation in db.session.query(Conversation)
-            .filter(
-                or_(
-                    Conversation.recipient_id == current_user.id,
-                    Conversation._sender_id == current_user.id,
-                )
+            for conversation, messages in Conversation.get_inbox(
+                current_user.id,
+                page_size=page_size,
+                before=before,
+                before_id=before_id,
             )
-            .all()
         ]
         return jsonify(data)
     elif request.method == "POST":
@@ -58,7 +147,14 @@ def get_or_create_conversations():
             _sender_id=current_user.id, recipient_id=data["recipient_id"]
         )
         db.session.add(conversation)
-        db.session.flush()
+        try:
+            db.session.flush()
+        except IntegrityError as err:
+            db.session.rollback()
+            # created concurrently since the check above
+            if err.orig.diag.constraint_name == "ix_conversations_participants":
+                abort(400, "Conversation already exists")
+            raise
 
         if not conversation.are_friends():
             db.session.rollback()
@@ -70,18 +166,31 @@ def get_or_create_conversations():
             conversation_id=conversation.id,
         )
         db.session.add(message)
+        conversation.record_message(message)
         db.session.commit()
 
         client_user_id = conversation.recipient_id
-        event_data = {"id": str(conversation.id), "kind": "NEW", "name": "conversation"}
+        conversation_data = {
+            **ConversationSchema().dump(conversation),
+            "messages": [MessageSchema().dump(message)],
+        }
+        event_data = {
+            "id": str(conversation.id),
+            "kind": "NEW",
+            "name": "conversation",
+            "conversation": {
+                **conversation_data,
+                "unreadCount": conversation.unread_count_for(client_user_id),
+            },
+        }
         from websockets import send_event_to_client
 
         send_event_to_client(event_data, client_user_id)
 
         return jsonify(
             {
-                **ConversationSchema().dump(conversation),
-                "messages": [MessageSchema().dump(message)],
+                **conversation_data,
+                "unreadCount": conversation.unread_count_for(current_user.id),
             }
         )
 
@@ -105,43 +214,29 @@ def get_or_update_or_remove_conversation(conversation_id):
         if timestamp:
             timestamp = datetime.fromisoformat(timestamp)
 
+        message_id = request.args.get("messageId")
+        if message_id:
+            try:
+                message_id = uuid.UUID(message_id)
+            except ValueError:
+                abort(400, "Invalid message id")
+
         messages = [
             MessageSchema().dump(message)
             for message in conversation.get_messages(
-                current_user.id, messages_limt, timestamp
+                current_user.id, messages_limt, timestamp, message_id
             )
         ]
 
         return jsonify(
-            {**ConversationSchema().dump(conversation), "messages": messages}
+            {
+                **ConversationSchema().dump(conversation),
+                "unreadCount": conversation.unread_count_for(current_user.id),
+                "messages": messages,
+            }
         )
     elif request.method == "POST":
-        if not conversation.are_friends():
-            abort(400, "You cannot message this user as you are not friends")
-
-        payload = request.get_json()
-        try:
-            data = MessageSchema().load(payload)
-        except ValidationError as err:
-            abort(422, extract_all_errors(err))
-
-        message = Message(
-            **data, sender_id=current_user.id, conversation_id=conversation_id
-        )
-        db.session.add(message)
-        db.session.commit()
-
-        event_data = {
-            "id": str(conversation.id),
-            "kind": "UPDATE",
-            "name": "conversation",
-        }
-
-        from websockets import send_event_to_client
-
-        send_event_to_client(event_data, client_user_id)
-
-        return jsonify(MessageSchema().dump(message))
+        return jsonify(post_message(conversation, request.get_json()))
     elif request.method == "DELETE":
         if (
             current_user.id == conversation.sender_id
@@ -165,6 +260,31 @@ def get_or_update_or_remove_conversation(conversation_id):
             abort(400, "You do not have permission to delete this conversation")
 
 
+@conversations.route("/<conversation_id>/unread", methods=["GET"])
+@login_required
+def get_unread_messages(conversation_id):
+    conversation = Conversation.query.get(conversation_id)
+    if not conversation or current_user.id not in (
+        conversation.sender_id,
+        conversation.recipient_id,
+    ):
+        abort(400, "Conversation does not exist")
+
+    messages_limt = int(request.args.get("limit", 10))
+    messages = [
+        MessageSchema().dump(message)
+        for message in conversation.get_unread_messages(current_user.id, messages_limt)
+    ]
+
+    return jsonify(
+        {
+            **ConversationSchema().dump(conversation),
+            "unreadCount": conversation.unread_count_for(current_user.id),
+            "messages": messages,
+        }
+    )
+
+
 @conversations.route("/messages/delete", methods=["DELETE"])
 @login_required
 def delete_message():
@@ -174,32 +294,59 @@ def delete_message():
     except ValidationError as err:
         abort(422, extract_all_errors(err))
 
-    messages = []
-    msgs_non_existent = []
-    msgs_deleted = []
-
-    for msg_id in data["ids"]:
-        msg = Message.query.get(msg_id)
-        if msg is None:
-            msgs_non_existent.append(str(msg_id))
-        elif msg.deleted_by == current_user.id:
-            msgs_deleted.append(str(msg_id))
-        else:
-            messages.append(msg)
+    ids = list(dict.fromkeys(data["ids"]))
+    found = {
+        msg.id: msg
+        for msg in db.session.query(
+            Message.id,
+            Message.conversation_id,
+            Message.deleted_by,
+            Message.conversation_id.in_(Conversation.ids_for(current_user.id)).label(
+                "is_participant"
+            ),
+        ).filter(Message.id.in_(ids))
+    }
+
+    msgs_non_existent = [str(msg_id) for msg_id in ids if msg_id not in found]
+    msgs_forbidden = [
+        str(msg_id) for msg_id, msg in found.items() if not msg.is_participant
+    ]
+    msgs_deleted = [
+        str(msg_id)
+        for msg_id, msg in found.items()
+        if msg.deleted_by == current_user.id
+    ]
 
     if msgs_non_existent:
         abort(400, f"Messages {','.join(msgs_non_existent)} are not exist")
 
+    if msgs_forbidden:
+        abort(
+            400,
+            f"You do not have permission to delete messages {','.join(msgs_forbidden)}",
+        )
+
     if msgs_deleted:
         abort(400, f"Messages {','.join(msgs_deleted)} are already deleted")
 
-    for message in messages:
-        if message.deleted_by is None:
-            message.deleted_by = current_user.id
-            db.session.add(message)
-        else:
-            db.session.delete(message)
-
+    # messages already deleted by the other participant are removed for good,
+    # the rest are hidden from the current user only
+    db.session.execute(
+        delete(Message)
+        .where(
+            Message.id.in_(ids),
+            Message.deleted_by.isnot(None),
+            Message.deleted_by != current_user.id,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(Message)
+        .where(Message.id.in_(ids), Message.deleted_by.is_(None))
+        .values(deleted_by=current_user.id)
+        .execution_options(synchronize_session=False)
+    )
+    Conversation.refresh_summaries({msg.conversation_id for msg in found.values()})
     db.session.commit()
 
     return jsonify({"message": "Messages has been deleted"})
@@ -210,33 +357,69 @@ def delete_message():
 def read_messages():
     payload = request.get_json()
     try:
-        data = Messages().load(payload)
+        data = ReadMessagesSchema().load(payload)
     except ValidationError as err:
         abort(422, extract_all_errors(err))
 
-    messages = []
-    msgs_non_existent = []
-    msgs_read = []
+    read_at = datetime.utcnow()
+    own_messages = Message.conversation_id.in_(Conversation.ids_for(current_user.id))
 
-    for msg_id in data["ids"]:
-        msg = Message.query.get(msg_id)
-        if msg is None:
-            msgs_non_existent.append(str(msg_id))
-        elif msg.read is not None:
-            msgs_read.append(str(msg_id))
-        else:
-            messages.append(msg)
+    if "up_to" in data:
+        watermark = (
+            db.session.query(Message.conversation_id, Message.created_at, Message.id)
+            .filter(Message.id == data["up_to"], own_messages)
+            .first()
+        )
+        if watermark is None:
+            abort(400, f"Messages {data['up_to']} are not exist")
+
+        db.session.execute(
+            update(Message)
+            .where(
+                Message.conversation_id == watermark.conversation_id,
+                Message.sender_id != current_user.id,
+                Message.read.is_(None),
+                tuple_(Message.created_at, Message.id)
+                <= tuple_(watermark.created_at, watermark.id),
+            )
+            .values(read=read_at)
+            .execution_options(synchronize_session=False)
+        )
+        Conversation.refresh_summaries({watermark.conversation_id})
+        db.session.commit()
 
-    if msgs_non_existent:
-        abort(400, f"Messages {','.join(msgs_non_existent)} are not exist")
+        return jsonify({"message": "Messages has been read"})
+
+    ids = list(dict.fromkeys(data["ids"]))
+    read = db.session.execute(
+        update(Message)
+        .where(Message.id.in_(ids), Message.read.is_(None), own_messages)
+        .values(read=read_at)
+        .returning(Message.id, Message.conversation_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    read_ids = {msg.id for msg in read}
+
+    if len(read_ids) != len(ids):
+        db.session.rollback()
+
+        unread_ids = [msg_id for msg_id in ids if msg_id not in read_ids]
+        existing_ids = set(
+            db.session.execute(
+                select(Message.id).where(Message.id.in_(unread_ids), own_messages)
+            ).scalars()
+        )
+        msgs_non_existent = [
+            str(msg_id) for msg_id in unread_ids if msg_id not in existing_ids
+        ]
+        msgs_read = [str(msg_id) for msg_id in unread_ids if msg_id in existing_ids]
 
-    if msgs_read:
-        abort(400, f"Messages {','.join(msgs_read)} are already read")
+        if msgs_non_existent:
+            abort(400, f"Messages {','.join(msgs_non_existent)} are not exist")
 
-    for msg in messages:
-        msg.read = datetime.utcnow()
+        abort(400, f"Messages {','.join(msgs_read)} are already read")
 
-    db.session.add_all(messages)
+    Conversation.refresh_summaries({msg.conversation_id for msg in read})
     db.session.commit()
 
     return jsonify({"message": "Messages has been read"})
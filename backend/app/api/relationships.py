@@ -1,19 +1,25 @@
 import logging
 
-from flask import Blueprint, abort, jsonify
+from flask import Blueprint, abort, jsonify, request
 from flask_login import current_user, login_required
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, case, exists, or_, select
+from sqlalchemy.orm import load_only
 
 from app import db
 from app.models.relationship import FriendState, Relationship, RelationshipType
 from app.models.user import User
 from app.models.conversation import Conversation
+from app.models.friend_suggestion import FriendSuggestion
+from app.tasks import refresh_friend_suggestions
+from app.utils import relationship_cache
 
 
 logger = logging.getLogger(__name__)
 
 relationships = Blueprint("relationships", __name__, url_prefix="/relationships")
 
+MAX_SUGGESTIONS = 50
+
 
 def remove_all_relationships(current_user_id, user_id, is_unblock=False):
     """Removes all relationships between two users"""
@@ -47,76 +53,82 @@ def remove_all_relationships(current_user_id, user_id, is_unblock=False):
         db.session.delete(relationship)
 
 
-def _get_friends(user_id, include_requests=True):
-    _relationships = (
-        db.session.query(Relationship)
-        .filter(
-            or_(
-                Relationship.requester_id == user_id,
-                Relationship.addressee_id == user_id,
-            )
-        )
-        .filter(Relationship.relationship_type == RelationshipType.FRIEND)
-        .all()
-    )
-
-    candidates = {}
+def send_relationship_event(user, kind, state=None):
+    """Tells ``user`` how their relationship with the current user changed"""
+    event_data = {
+        "name": "relationship",
+        "kind": kind,
+        "id": current_user.id,
+        "user": current_user.to_minimal(state is FriendState.ACCEPTED),
+    }
+    if state is not None:
+        event_data["state"] = state.name
 
-    for relationship in _relationships:
-        if relationship.requester_id == user_id:
-            if relationship.addressee_id not in candidates:
-                candidates[relationship.addressee_id] = FriendState.REQUESTED
-            else:
-                candidates[relationship.addressee_id] = FriendState.ACCEPTED
-        else:
-            if relationship.requester_id not in candidates:
-                candidates[relationship.requester_id] = FriendState.REQUESTEE
-            else:
-                candidates[relationship.requester_id] = FriendState.ACCEPTED
+    from websockets import send_event_to_client
 
-    friend_ids = [key for key in candidates if candidates[key] is FriendState.ACCEPTED]
+    send_event_to_client(event_data, user.id)
 
-    result = {}
 
-    friends = db.session.query(User).filter(User.id.in_(list(friend_ids))).all()
-    result["friends"] = [friend.to_minimal(True) for friend in friends]
+def refresh_suggestions(user_id, other_id):
+    """
+    Queues recomputing the suggestions a change between two users affects,
+    theirs and their friends', who gain or lose a friend in common with them
+    """
+    affected = {user_id, other_id}
+    for id in (user_id, other_id):
+        added_ids, added_by_ids = relationship_cache.get_edges(
+            id, RelationshipType.FRIEND
+        )
+        affected |= added_ids & added_by_ids
 
-    if not include_requests:
-        return result
+    refresh_friend_suggestions.delay(sorted(affected))
 
-    friend_request_ids = [
-        key for key in candidates if candidates[key] is FriendState.REQUESTEE
-    ]
 
-    friend_requests = (
-        db.session.query(User).filter(User.id.in_(friend_request_ids)).all()
+def _get_friends(user_id, include_requests=True):
+    """
+    Friends, friend requests and other conversation partners of a user, in a
+    fixed number of queries however many relationships the user has
+    """
+    added_ids, added_by_ids = relationship_cache.get_edges(
+        user_id, RelationshipType.FRIEND
     )
+    # a friendship is an edge in each direction
+    friend_ids = added_ids & added_by_ids
+    minimal = load_only(*User.MINIMAL_COLUMNS)
 
-    result["friendRequests"] = [
-        friend_request.to_minimal() for friend_request in friend_requests
-    ]
+    if not include_requests:
+        friends = User.query.options(minimal).filter(User.id.in_(friend_ids)).all()
+        return {"friends": [friend.to_minimal(True) for friend in friends]}
 
-    other_ids = [
-        conversation.recipient_id
-        if conversation.sender_id == user_id
-        else conversation.sender_id
-        for conversation in db.session.query(Conversation)
-        .filter(
+    request_ids = added_by_ids - added_ids
+    partner_id = case(
+        (Conversation._sender_id == user_id, Conversation.recipient_id),
+        else_=Conversation._sender_id,
+    )
+    is_partner = User.id.in_(
+        select(partner_id).where(
             or_(
-                Conversation.recipient_id == user_id, Conversation._sender_id == user_id
+                Conversation._sender_id == user_id,
+                Conversation.recipient_id == user_id,
             )
         )
+    )
+    users = (
+        db.session.query(User, is_partner)
+        .options(minimal)
+        .filter(or_(User.id.in_(friend_ids | request_ids), is_partner))
         .all()
-    ]
-
-    others = []
-    for id in other_ids:
-        if id not in friend_ids:
-            other = User.query.get(id)
-            if other:
-                others.append(other.to_minimal())
+    )
 
-    result["others"] = others
+    result = {"friends": [], "friendRequests": [], "others": []}
+    for user, partner in users:
+        if user.id in friend_ids:
+            result["friends"].append(user.to_minimal(True))
+            continue
+        if user.id in request_ids:
+            result["friendRequests"].append(user.to_minimal())
+        if partner:
+            result["others"].append(user.to_minimal())
 
     return result
 
@@ -127,6 +139,42 @@ def get_friends():
     return jsonify(_get_friends(current_user.id))
 
 
+@relationships.route("/suggestions", methods=["GET"])
+@login_required
+def get_suggestions():
+    limit = min(max(int(request.args.get("limit", 10)), 1), MAX_SUGGESTIONS)
+
+    # suggestions are refreshed asynchronously, skip users related since
+    related = exists().where(
+        or_(
+            and_(
+                Relationship.requester_id == current_user.id,
+                Relationship.addressee_id == FriendSuggestion.suggested_id,
+            ),
+            and_(
+                Relationship.requester_id == FriendSuggestion.suggested_id,
+                Relationship.addressee_id == current_user.id,
+            ),
+        )
+    )
+    suggestions = (
+        db.session.query(User, FriendSuggestion.mutual_friends)
+        .options(load_only(*User.MINIMAL_COLUMNS))
+        .join(FriendSuggestion, FriendSuggestion.suggested_id == User.id)
+        .filter(FriendSuggestion.user_id == current_user.id, ~related)
+        .order_by(FriendSuggestion.mutual_friends.desc(), FriendSuggestion.suggested_id)
+        .limit(limit)
+        .all()
+    )
+
+    return jsonify(
+        [
+            {**user.to_minimal(), "mutualFriends": mutual_friends}
+            for user, mutual_friends in suggestions
+        ]
+    )
+
+
 @relationships.route("/block/<username>", methods=["POST"])
 @login_required
 def block_user(username):
@@ -148,10 +196,10 @@ def block_user(username):
 
     db.session.add(block)
     db.session.commit()
+    relationship_cache.refresh_pair(current_user.id, user.id)
+    refresh_suggestions(current_user.id, user.id)
 
-    from websockets import send_event_to_client
-
-    send_event_to_client({"name": "relationship"}, user.id)
+    send_relationship_event(user, "DELETE")
 
     return jsonify({"message": f"Blocked {username}"})
 
@@ -170,10 +218,10 @@ def unblock_user(username):
     remove_all_relationships(current_user.id, user.id, True)
 
     db.session.commit()
+    relationship_cache.refresh_pair(current_user.id, user.id)
+    refresh_suggestions(current_user.id, user.id)
 
-    from websockets import send_event_to_client
-
-    send_event_to_client({"name": "relationship"}, user.id)
+    send_relationship_event(user, "DELETE")
 
     return jsonify({"message": f"Unblocked {username}"})
 
@@ -190,22 +238,15 @@ def add_user(username):
         abort(404, "User not found")
 
     # Check if user has been blocked by the adder
-    blocked = Relationship.query.filter_by(
-        requester_id=user.id,
-        addressee_id=current_user.id,
-        relationship_type=RelationshipType.BLOCK,
-    ).first()
-    if blocked:
+    if relationship_cache.has_edge(user.id, current_user.id, RelationshipType.BLOCK):
         abort(404, "User not found")
 
-    # check if user is already added
-    relationship = Relationship.query.filter_by(
-        requester_id=current_user.id,
-        addressee_id=user.id,
-        relationship_type=RelationshipType.FRIEND,
-    ).first()
+    # the pair can only have one relationship, unblock first
+    if relationship_cache.has_edge(current_user.id, user.id, RelationshipType.BLOCK):
+        abort(400, "User blocked")
 
-    if relationship:
+    # check if user is already added
+    if relationship_cache.has_edge(current_user.id, user.id, RelationshipType.FRIEND):
         abort(400, "User already added")
 
     friendship = Relationship(
@@ -216,10 +257,18 @@ def add_user(username):
 
     db.session.add(friendship)
     db.session.commit()
+    relationship_cache.refresh_pair(current_user.id, user.id)
+    refresh_suggestions(current_user.id, user.id)
 
-    from websockets import send_event_to_client
-
-    send_event_to_client({"name": "relationship"}, user.id)
+    # the addressee sees a request, or a friend if they had added us already
+    accepted = relationship_cache.has_edge(
+        user.id, current_user.id, RelationshipType.FRIEND
+    )
+    send_relationship_event(
+        user,
+        "UPDATE",
+        FriendState.ACCEPTED if accepted else FriendState.REQUESTEE,
+    )
 
     return jsonify({"message": f"Added {username}"})
 
@@ -238,9 +287,9 @@ def delete_user(username):
     remove_all_relationships(current_user.id, user.id)
 
     db.session.commit()
+    relationship_cache.refresh_pair(current_user.id, user.id)
+    refresh_suggestions(current_user.id, user.id)
 
-    from websockets import send_event_to_client
-
-    send_event_to_client({"name": "relationship"}, user.id)
+    send_relationship_event(user, "DELETE")
 
     return jsonify({"message": f"Deleted friend {username}"})
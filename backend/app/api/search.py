@@ -1,17 +1,150 @@
 import logging
+import re
 
-from flask import Blueprint, abort, request
+from flask import Blueprint, abort, current_app, jsonify, request
 from flask_login import current_user, login_required
+from sqlalchemy import exists, func, or_
+from sqlalchemy.orm import aliased, load_only
 
-from app.api.relationships import _get_friends
+from app import db
+from app.models.conversation import Conversation
+from app.models.message import Message
 from app.models.relationship import FriendState, Relationship, RelationshipType
 from app.models.user import User
-from app.utils import get_test_emails
+from app.serde import MessageSchema
+from app.utils import is_test_email, relationship_cache, search_index
 
 logger = logging.getLogger(__name__)
 
 search = Blueprint("search", __name__, url_prefix="/search")
 
+MAX_SEARCH_LIMIT = 50
+MAX_SEARCH_TERMS = 8
+
+# what html.escape replaces, ampersands first so entities are not escaped twice
+HTML_ESCAPES = (
+    ("&", "&amp;"),
+    ("<", "&lt;"),
+    (">", "&gt;"),
+    ('"', "&quot;"),
+    ("'", "&#x27;"),
+)
+
+
+def _prefix_query(term):
+    """
+    Turns free text into a tsquery matching every word as a prefix, only
+    word characters are kept so the text cannot inject tsquery operators
+    """
+    words = re.findall(r"\w+", term)[:MAX_SEARCH_TERMS]
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def _html_escape(text):
+    for character, entity in HTML_ESCAPES:
+        text = func.replace(text, character, entity)
+    return text
+
+
+def _visible_users(user_id):
+    """Users the user may find, everyone but themselves and who blocked them"""
+    blocked_by = exists().where(
+        Relationship.requester_id == User.id,
+        Relationship.addressee_id == user_id,
+        Relationship.relationship_type == RelationshipType.BLOCK,
+    )
+    return User.query.options(load_only(*User.MINIMAL_COLUMNS)).filter(
+        User.id != user_id, ~blocked_by
+    )
+
+
+def _search_users(user_id, term, page=1, limit=10):
+    prefix_query = _prefix_query(term)
+    if not prefix_query:
+        return []
+
+    query = func.to_tsquery("english", prefix_query)
+    rank = func.ts_rank(User.__ts_vector__, query)
+
+    return (
+        _visible_users(user_id)
+        .filter(User.__ts_vector__.op("@@")(query))
+        .order_by(rank.desc(), User.id)
+        .limit(limit)
+        .offset((page - 1) * limit)
+        .all()
+    )
+
+
+def _search_messages(user_id, term, page=1, limit=10):
+    """
+    Ranks the messages of the user's conversations matching the term and
+    highlights the matches. Only the requested page is highlighted, as
+    ts_headline has to re-parse the message body. The body is escaped before
+    it is highlighted, so the only markup in a highlight is the marks.
+    """
+    query = func.websearch_to_tsquery("english", term)
+    rank = func.ts_rank(Message.__ts_vector__, query)
+
+    ranked = (
+        db.session.query(Message, rank.label("rank"))
+        .filter(Message.__ts_vector__.op("@@")(query))
+        .filter(Message.conversation_id.in_(Conversation.ids_for(user_id)))
+        .filter(or_(Message.deleted_by.is_(None), Message.deleted_by != user_id))
+        .order_by(rank.desc(), Message.created_at.desc())
+        .limit(limit)
+        .offset((page - 1) * limit)
+        .subquery()
+    )
+    message = aliased(Message, ranked)
+    highlight = func.ts_headline(
+        "english",
+        _html_escape(ranked.c.body),
+        query,
+        "StartSel=<mark>, StopSel=</mark>, MaxFragments=2",
+    )
+
+    return (
+        db.session.query(message, highlight)
+        .order_by(ranked.c.rank.desc(), ranked.c.created_at.desc())
+        .all()
+    )
+
+
+def _similar_users(user_id, term, page=1, limit=10):
+    """
+    Typo tolerant fallback, matches usernames and names by trigram
+    similarity. Needs the pg_trgm extension and its indexes on users.
+    """
+    similarity = func.greatest(
+        func.similarity(User.username, term), func.similarity(User.name, term)
+    )
+
+    return (
+        _visible_users(user_id)
+        .filter(or_(User.username.op("%")(term), User.name.op("%")(term)))
+        .order_by(similarity.desc(), User.id)
+        .limit(limit)
+        .offset((page - 1) * limit)
+        .all()
+    )
+
+
+@search.route("/suggest", methods=["GET"])
+@login_required
+def suggest_users():
+    """Typeahead, served from the prefix index without touching Postgres"""
+    term = request.args.get("term", "")
+    limit = min(max(int(request.args.get("limit", 10)), 1), MAX_SEARCH_LIMIT)
+
+    _, blocked_by_ids = relationship_cache.get_edges(
+        current_user.id, RelationshipType.BLOCK
+    )
+
+    return jsonify(
+        search_index.suggest(term, limit, blocked_by_ids | {current_user.id})
+    )
+
 
 @search.route("/user/<username>", methods=["GET"])
 @login_required
@@ -23,53 +156,16 @@ def search_user(username):
     if not user:
         abort(400, "User doesn't exist")
 
-    # check if user has blocked you
-    blocked = Relationship.query.filter_by(
-        requester_id=user.id,
-        addressee_id=current_user.id,
-        relationship_type=RelationshipType.BLOCK,
-    ).first()
-
-    if blocked:
+    relationship_state = Relationship.get_state(current_user.id, user.id)
+    if relationship_state is FriendState.BLOCKEE:
         abort(400, "Unable to view this user")
 
-    # check if you have blocked the user
-    block = Relationship.query.filter_by(
-        requester_id=current_user.id,
-        addressee_id=user.id,
-        relationship_type=RelationshipType.BLOCK,
-    ).first()
-
-    relationship_from = Relationship.query.filter_by(
-        requester_id=current_user.id,
-        addressee_id=user.id,
-        relationship_type=RelationshipType.FRIEND,
-    ).first()
-
-    relationship_to = Relationship.query.filter_by(
-        requester_id=user.id,
-        addressee_id=current_user.id,
-        relationship_type=RelationshipType.FRIEND,
-    ).first()
-
-    # determine relationship state
-    if relationship_from and relationship_to:
-        relationship_state = FriendState.ACCEPTED
-    elif relationship_from:
-        relationship_state = FriendState.REQUESTED
-    elif relationship_to:
-        relationship_state = FriendState.REQUESTEE
-    elif block:
-        relationship_state = FriendState.BLOCKED
-    else:
-        relationship_state = None
-
     profile = {
         "name": user.name,
         "username": user.username,
         "location": user.location,
         "gravatar": user.gravatar(size=400, default="robohash", rating="x")
-        if user.email in get_test_emails()
+        if is_test_email(user.email)
         else user.gravatar(size=400),
         "relationshipState": relationship_state.value
         if relationship_state
@@ -77,14 +173,12 @@ def search_user(username):
     }
 
     if relationship_state is FriendState.ACCEPTED:
-        friends = _get_friends(user.id, include_requests=False)
-        number_of_friends = len(friends["friends"])
         return {
             **profile,
             "aboutMe": user.about_me,
             "lastSeen": user.last_seen,
             "memberSince": user.member_since,
-            "numberOfFriends": number_of_friends,
+            "numberOfFriends": Relationship.count_friends(user.id),
         }
 
     return profile
@@ -97,29 +191,36 @@ def search_all():
     This will do a full text scan of
     - usernames
     - names
-    - messages (TO DO)
+    - messages
     """
     results = {}
     term = request.args.get("term")
     if not term:
         abort(400, "No search term supplied")
 
-    for _term in set(term.split(" ")):
-        users = User.query.filter(User.__ts_vector__.match(_term)).all()
-        if users is not None:
-            break
+    page = max(int(request.args.get("page", 1)), 1)
+    limit = min(max(int(request.args.get("limit", 10)), 1), MAX_SEARCH_LIMIT)
 
-    blocked = Relationship.query.filter_by(
-        addressee_id=current_user.id, relationship_type=RelationshipType.BLOCK
-    ).all()
-    blocked_ids = {val.requester_id for val in blocked}
+    users = _search_users(current_user.id, term, page, limit)
+    if not users and current_app.config["SEARCH_TRIGRAM_FALLBACK"]:
+        users = _similar_users(current_user.id, term, page, limit)
 
     results["users"] = {
         "name": "users",
+        "results": [user.to_minimal() for user in users],
+    }
+
+    results["messages"] = {
+        "name": "messages",
         "results": [
-            user.to_minimal()
-            for user in users
-            if user.id not in blocked_ids and user.id != current_user.id
+            {
+                **MessageSchema().dump(message),
+                "conversationId": str(message.conversation_id),
+                "highlight": highlight,
+            }
+            for message, highlight in _search_messages(
+                current_user.id, term, page, limit
+            )
         ],
     }
 
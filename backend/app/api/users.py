@@ -3,9 +3,11 @@ import os
 from flask import Blueprint, abort, jsonify, request
 from flask_login import current_user, login_required, login_user, logout_user
 from marshmallow.exceptions import ValidationError
+from sqlalchemy import or_
 
 from app import db
 from app.models.conversation import Conversation
+from app.models.relationship import Relationship
 from app.models.user import User
 from app.serde import (
     ChangeEmailSchema,
@@ -17,7 +19,13 @@ from app.serde import (
     UserUpdateSchema,
 )
 from app.serde.user import UserSchema
-from app.utils import extract_all_errors
+from app.tasks import refresh_friend_suggestions
+from app.utils import (
+    extract_all_errors,
+    relationship_cache,
+    search_index,
+    user_cache,
+)
 from app.utils.email import send_email
 
 logger = logging.getLogger(__name__)
@@ -46,10 +54,28 @@ def delete_user():
     if not current_user.verify_password(data["password"]):
         abort(400, "Invalid credentials")
 
+    user_id = current_user.id
+    other_ids = [
+        relationship.addressee_id
+        if relationship.requester_id == user_id
+        else relationship.requester_id
+        for relationship in Relationship.query.filter(
+            or_(
+                Relationship.requester_id == user_id,
+                Relationship.addressee_id == user_id,
+            )
+        )
+    ]
+
     Conversation.query.filter_by(_sender_id=current_user.id, recipient_id=None).delete()
     Conversation.query.filter_by(recipient_id=current_user.id, _sender_id=None).delete()
     db.session.delete(current_user)
     db.session.commit()
+    user_cache.invalidate(user_id)
+    relationship_cache.forget_user(user_id, other_ids)
+    search_index.remove_user(user_id)
+    if other_ids:
+        refresh_friend_suggestions.delay(sorted(set(other_ids)))
 
     return jsonify({"message": "Deleted user"})
 
@@ -105,6 +131,7 @@ def register():
     response.status_code = 201
 
     db.session.commit()
+    search_index.index_user(user)
 
     token = user.generate_confirmation_token()
     send_email(
@@ -139,6 +166,8 @@ def update_user():
 
     db.session.add(user)
     db.session.commit()
+    user_cache.invalidate(user.id)
+    search_index.index_user(user)
 
     return jsonify(UserSchema().dump(user))
 
@@ -153,6 +182,7 @@ def confirm(token):
         abort(400, "The confirmation link is invalid or has expired.")
 
     db.session.commit()
+    user_cache.invalidate(current_user.id)
     return jsonify({"message": "You have confirmed your account. Thanks!"})
 
 
@@ -192,6 +222,7 @@ def change_password():
     current_user.password = data["password"]
     db.session.add(current_user)
     db.session.commit()
+    user_cache.invalidate(current_user.id)
 
     return jsonify({"message": "Successfully changed password"})
 
@@ -285,4 +316,7 @@ def change_email(token):
         abort(400, "Invalid request")
 
     db.session.commit()
+    user_cache.invalidate(current_user.id)
+    # the gravatar follows the email
+    search_index.index_user(current_user)
     return jsonify({"message": "Your email address has been updated"})
@@ -1 +1 @@
-__all__ = ("user", "relationship", "message", "conversation")
+__all__ = ("user", "relationship", "message", "conversation", "friend_suggestion")
@@ -2,17 +2,20 @@ import uuid
 import logging
 from datetime import datetime
 
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, func, or_, select, true, tuple_, union_all, update
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import aliased
 
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from app import db
 from app.models.message import Message
-from app.models.relationship import Relationship
+from app.utils import relationship_cache
 
 
 logger = logging.getLogger(__name__)
 
+PREVIEW_LENGTH = 100
+
 
 class UniqueConstraint(Exception):
     pass
@@ -31,6 +34,23 @@ class Conversation(db.Model):
         db.Integer, db.ForeignKey("users.id", ondelete="SET NULL"), nullable=True
     )
     created_at = db.Column(db.DateTime(), default=datetime.utcnow)
+    # participants in a canonical order so either direction is one index probe
+    least_user_id = db.Column(
+        db.Integer, db.Computed("LEAST(sender_id, recipient_id)", persisted=True)
+    )
+    greatest_user_id = db.Column(
+        db.Integer, db.Computed("GREATEST(sender_id, recipient_id)", persisted=True)
+    )
+    # kept up to date by the message send, read and delete paths
+    last_message_at = db.Column(db.DateTime(), default=datetime.utcnow, nullable=False)
+    # shared by both participants, so it skips messages either of them deleted
+    last_message_preview = db.Column(db.String(PREVIEW_LENGTH))
+    sender_unread_count = db.Column(
+        db.Integer, default=0, server_default="0", nullable=False
+    )
+    recipient_unread_count = db.Column(
+        db.Integer, default=0, server_default="0", nullable=False
+    )
     messages = db.relationship(
         "Message",
         back_populates="conversation",
@@ -40,90 +60,302 @@ class Conversation(db.Model):
     sender = db.relationship("User", foreign_keys=[_sender_id])
     recipient = db.relationship("User", foreign_keys=[recipient_id])
 
+    __table_args__ = (
+        db.Index(
+            "ix_conversations_participants",
+            least_user_id,
+            greatest_user_id,
+            unique=True,
+            postgresql_where=and_(_sender_id.isnot(None), recipient_id.isnot(None)),
+        ),
+        db.Index("ix_conversations_sender_inbox", _sender_id, last_message_at, id),
+        db.Index("ix_conversations_recipient_inbox", recipient_id, last_message_at, id),
+    )
+
+    def _visible_messages(self, requester_id: int):
+        return (
+            db.session.query(Message)
+            .filter(Message.conversation_id == self.id)
+            .filter(
+                or_(Message.deleted_by.is_(None), Message.deleted_by != requester_id)
+            )
+        )
+
     def get_messages(
-        self, requester_id: int, limit: int = 10, timestamp: Optional[datetime] = None
-    ):
-        if timestamp:
-            msgs = [
-                message
-                for message in db.session.query(Message)
-                .filter(Message.conversation_id == self.id)
-                .filter(Message.created_at < timestamp)
-                .filter(or_(Message.deleted_by.is_(None), Message.deleted_by != 1))
-                .order_by(Message.created_at.desc())
-                .limit(limit)
-                .all()
-            ]
+        self,
+        requester_id: int,
+        limit: int = 10,
+        timestamp: Optional[datetime] = None,
+        message_id: Optional[uuid.UUID] = None,
+    ) -> List[Message]:
+        """
+        Returns the page of ``limit`` messages preceding the cursor, oldest
+        first. The cursor is the ``(timestamp, message_id)`` of the oldest
+        message the client already has; without a timestamp the latest page
+        is returned. Each page is a single range scan over
+        ``ix_messages_conversation_id_created_at_id``.
+        """
+        query = self._visible_messages(requester_id)
 
-        else:
-            maximum_limit = (
-                db.session.query(Message)
-                .filter(
-                    Message.conversation_id == self.id,
-                )
-                .count()
+        if timestamp and message_id:
+            query = query.filter(
+                tuple_(Message.created_at, Message.id) < tuple_(timestamp, message_id)
+            )
+        elif timestamp:
+            query = query.filter(Message.created_at < timestamp)
+
+        msgs = (
+            query.order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(limit)
+            .all()
+        )
+
+        return msgs[::-1]
+
+    def get_first_unread_message(self, requester_id: int) -> Optional[Message]:
+        return (
+            self._visible_messages(requester_id)
+            .filter(Message.read.is_(None), Message.sender_id != requester_id)
+            .order_by(Message.created_at, Message.id)
+            .first()
+        )
+
+    def get_unread_messages(self, requester_id: int, limit: int = 10) -> List[Message]:
+        """
+        Returns the page of ``limit`` messages starting at the oldest message
+        the requester has not read, oldest first. Falls back to the latest page
+        when everything has been read.
+        """
+        first_unread = self.get_first_unread_message(requester_id)
+        if first_unread is None:
+            return self.get_messages(requester_id, limit)
+
+        return (
+            self._visible_messages(requester_id)
+            .filter(
+                tuple_(Message.created_at, Message.id)
+                >= tuple_(first_unread.created_at, first_unread.id)
             )
-            msgs = [
-                message
-                for message in db.session.query(Message)
-                .filter(Message.conversation_id == self.id)
-                .filter(or_(Message.deleted_by.is_(None), Message.deleted_by != 1))
-                .order_by(Message.created_at.desc())
-                .limit(limit)
-                .all()
-            ]
-
-            while limit <= maximum_limit and all(
-                [msg.read is None for msg in msgs if msg.sender_id != requester_id]
-            ):
-                limit += limit
-                logger.info(
-                    "Fetching additional messages for user_id: %d limit: %d"
-                    % (requester_id, limit)
+            .order_by(Message.created_at, Message.id)
+            .limit(limit)
+            .all()
+        )
+
+    @classmethod
+    def get_inbox(
+        cls,
+        requester_id: int,
+        limit: int = 10,
+        page_size: Optional[int] = None,
+        before: Optional[datetime] = None,
+        before_id: Optional[uuid.UUID] = None,
+    ) -> List[Tuple["Conversation", List[Message]]]:
+        """
+        Loads the conversations of the requester, most recently active first,
+        together with their latest messages in two queries. Each conversation
+        gets its latest ``limit`` messages, extended back to the oldest message
+        the requester has not read yet, read with index range scans bounded by
+        those messages rather than the whole history.
+
+        Conversations are paged with ``page_size`` and the
+        ``(last_message_at, id)`` cursor of the last conversation the client
+        already has.
+        """
+
+        def inbox(*conditions):
+            """The page from one of the inbox indexes, read in index order"""
+            page = select(cls).where(*conditions)
+            if before and before_id:
+                page = page.where(
+                    tuple_(cls.last_message_at, cls.id) < tuple_(before, before_id)
                 )
+            elif before:
+                page = page.where(cls.last_message_at < before)
 
-                msgs = [
-                    message
-                    for message in db.session.query(Message)
-                    .filter(Message.conversation_id == self.id)
-                    .filter(or_(Message.deleted_by.is_(None), Message.deleted_by != 1))
-                    .order_by(Message.created_at.desc())
-                    .limit(limit)
-                    .all()
-                ]
+            return page.order_by(cls.last_message_at.desc(), cls.id.desc()).limit(
+                page_size
+            )
 
-        return sorted(msgs, key=lambda x: x.created_at)
+        # an OR of the two participants would read and sort every conversation
+        # of the requester, each side is an ordered scan of its own index
+        pages = union_all(
+            inbox(cls._sender_id == requester_id),
+            inbox(
+                cls.recipient_id == requester_id,
+                cls._sender_id.is_distinct_from(requester_id),
+            ),
+        ).subquery()
+        conversation = aliased(cls, pages)
 
-    def are_friends(self) -> bool:
-        relationship_1 = Relationship.query.filter_by(
-            requester_id=self.sender_id, addressee_id=self.recipient_id
-        ).first()
-        relationship_2 = Relationship.query.filter_by(
-            requester_id=self.recipient_id, addressee_id=self.sender_id
-        ).first()
-
-        if relationship_1 and relationship_2:
-            return True
+        conversations = (
+            db.session.query(conversation)
+            .order_by(conversation.last_message_at.desc(), conversation.id.desc())
+            .limit(page_size)
+            .all()
+        )
+
+        if not conversations:
+            return []
+
+        visible = or_(Message.deleted_by.is_(None), Message.deleted_by != requester_id)
+        # the deferred search vector stays out of the laterals
+        columns = [
+            column
+            for column in Message.__table__.columns
+            if column.key != "__ts_vector__"
+        ]
+
+        # per conversation, one range scan of
+        # ix_messages_conversation_id_created_at_id for the latest messages
+        latest = (
+            select(*columns)
+            .where(Message.conversation_id == cls.id, visible)
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(limit)
+            .lateral("latest")
+        )
+        # one probe of ix_messages_unread for the oldest unread message
+        first_unread = (
+            select(Message.created_at, Message.id)
+            .where(
+                Message.conversation_id == cls.id,
+                Message.read.is_(None),
+                Message.sender_id != requester_id,
+                visible,
+            )
+            .order_by(Message.created_at, Message.id)
+            .limit(1)
+            .lateral("first_unread")
+        )
+        # and a range scan from it to the latest message
+        unread = (
+            select(*columns)
+            .where(
+                Message.conversation_id == cls.id,
+                visible,
+                tuple_(Message.created_at, Message.id)
+                >= tuple_(first_unread.c.created_at, first_unread.c.id),
+            )
+            # also keeps the planner from flattening it into a join over
+            # every message of the page
+            .order_by(Message.created_at, Message.id)
+            .lateral("unread")
+        )
+
+        in_page = cls.id.in_([c.id for c in conversations])
+        rows = union_all(
+            select(latest).select_from(cls).join(latest, true()).where(in_page),
+            select(unread)
+            .select_from(cls)
+            .join(first_unread, true())
+            .join(unread, true())
+            .where(in_page),
+        ).subquery()
+        message = aliased(Message, rows)
+
+        messages: Dict[uuid.UUID, List[Message]] = {c.id: [] for c in conversations}
+        seen = set()
+        # the latest messages and the unread ones overlap
+        for msg in db.session.query(message).order_by(message.created_at, message.id):
+            if msg.id not in seen:
+                seen.add(msg.id)
+                messages[msg.conversation_id].append(msg)
+
+        return [(c, messages[c.id]) for c in conversations]
+
+    def unread_count_for(self, user_id: int) -> int:
+        if user_id == self.sender_id:
+            return self.sender_unread_count
+
+        return self.recipient_unread_count
+
+    def record_message(self, message: Message):
+        """Updates the conversation summary for a message being sent"""
+        if message.created_at is None:
+            message.created_at = datetime.utcnow()
+
+        self.last_message_at = message.created_at
+        self.last_message_preview = message.body[:PREVIEW_LENGTH]
+
+        # increment in SQL so concurrent sends are not lost
+        if message.sender_id == self.sender_id:
+            self.recipient_unread_count = Conversation.recipient_unread_count + 1
         else:
-            return False
+            self.sender_unread_count = Conversation.sender_unread_count + 1
+
+        db.session.add(self)
 
     @classmethod
-    def conversation_exists(cls, sender_id: int, recipient_id: int) -> bool:
-        results = (
-            db.session.query(cls)
-            .filter(
-                or_(
-                    and_(cls.sender_id == sender_id, cls.recipient_id == recipient_id),
-                    and_(cls.sender_id == recipient_id, cls.recipient_id == sender_id),
+    def refresh_summaries(cls, conversation_ids):
+        """
+        Recomputes the last message and unread counts of the conversations in
+        a single statement, after messages were read or deleted. Unread
+        messages are counted through ``ix_messages_unread``.
+        """
+        if not conversation_ids:
+            return
+
+        def latest(column, *conditions):
+            return (
+                select(column)
+                .where(Message.conversation_id == cls.id, *conditions)
+                .order_by(Message.created_at.desc(), Message.id.desc())
+                .limit(1)
+                .scalar_subquery()
+            )
+
+        def unread_count(reader_id):
+            return (
+                select(func.count(Message.id))
+                .where(
+                    Message.conversation_id == cls.id,
+                    Message.read.is_(None),
+                    Message.sender_id != reader_id,
+                    or_(Message.deleted_by.is_(None), Message.deleted_by != reader_id),
                 )
+                .scalar_subquery()
             )
-            .all()
+
+        db.session.execute(
+            update(cls)
+            .where(cls.id.in_(list(conversation_ids)))
+            .values(
+                last_message_at=func.coalesce(
+                    latest(Message.created_at), cls.created_at
+                ),
+                last_message_preview=latest(
+                    func.left(Message.body, PREVIEW_LENGTH),
+                    Message.deleted_by.is_(None),
+                ),
+                sender_unread_count=unread_count(cls._sender_id),
+                recipient_unread_count=unread_count(cls.recipient_id),
+            )
+            .execution_options(synchronize_session=False)
         )
 
-        if results:
-            return True
+    def are_friends(self) -> bool:
+        if self.sender_id is None or self.recipient_id is None:
+            return False
+
+        return relationship_cache.are_friends(self.sender_id, self.recipient_id)
 
-        return False
+    @classmethod
+    def ids_for(cls, user_id: int):
+        """Selects the ids of every conversation the user takes part in"""
+        return select(cls.id).where(
+            or_(cls._sender_id == user_id, cls.recipient_id == user_id)
+        )
+
+    @classmethod
+    def conversation_exists(cls, sender_id: int, recipient_id: int) -> bool:
+        return db.session.query(
+            db.session.query(cls)
+            .filter(
+                cls.least_user_id == min(sender_id, recipient_id),
+                cls.greatest_user_id == max(sender_id, recipient_id),
+            )
+            .exists()
+        ).scalar()
 
     @property
     def sender_id(self):
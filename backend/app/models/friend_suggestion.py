@@ -0,0 +1,95 @@
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, delete, exists, func, insert, or_, select
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.models.relationship import Relationship, RelationshipType
+
+
+class FriendSuggestion(db.Model):
+    """
+    Friends of a user's friends ranked by the friends they have in common,
+    precomputed so suggestions never walk the graph at request time
+    """
+
+    __tablename__ = "friend_suggestions"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"))
+    suggested_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"))
+    mutual_friends = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint(user_id, suggested_id),
+        db.Index(
+            "ix_friend_suggestions_user_id_mutual_friends",
+            user_id,
+            mutual_friends.desc(),
+            suggested_id,
+        ),
+    )
+
+    @classmethod
+    def recompute(cls, user_ids: Optional[Iterable[int]] = None):
+        """
+        Replaces the suggestions of the given users, or of everyone, with
+        users two friendships away they have no relationship with yet
+        """
+        user_friend = aliased(Relationship)
+        friend_user = aliased(Relationship)
+        friend_other = aliased(Relationship)
+        other_friend = aliased(Relationship)
+
+        def mutual(edge, reverse):
+            return and_(
+                reverse.requester_id == edge.addressee_id,
+                reverse.addressee_id == edge.requester_id,
+                reverse.relationship_type == RelationshipType.FRIEND,
+            )
+
+        user_id = user_friend.requester_id
+        other_id = friend_other.addressee_id
+        related = exists().where(
+            or_(
+                and_(
+                    Relationship.requester_id == user_id,
+                    Relationship.addressee_id == other_id,
+                ),
+                and_(
+                    Relationship.requester_id == other_id,
+                    Relationship.addressee_id == user_id,
+                ),
+            )
+        )
+
+        # each friend in common is one (user, friend, other) path
+        suggestions = (
+            select(user_id, other_id, func.count())
+            .join(friend_user, mutual(user_friend, friend_user))
+            .join(
+                friend_other,
+                and_(
+                    friend_other.requester_id == user_friend.addressee_id,
+                    friend_other.relationship_type == RelationshipType.FRIEND,
+                ),
+            )
+            .join(other_friend, mutual(friend_other, other_friend))
+            .where(
+                user_friend.relationship_type == RelationshipType.FRIEND,
+                other_id != user_id,
+                ~related,
+            )
+            .group_by(user_id, other_id)
+        )
+        stale = delete(cls)
+
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            suggestions = suggestions.where(user_id.in_(user_ids))
+            stale = stale.where(cls.user_id.in_(user_ids))
+
+        db.session.execute(stale)
+        db.session.execute(
+            insert(cls).from_select(
+                [cls.user_id, cls.suggested_id, cls.mutual_friends], suggestions
+            )
+        )
@@ -4,6 +4,7 @@ from sqlalchemy.dialects.postgresql import UUID
 
 
 from app import db
+from app.models.ts_vector import TSVector
 
 
 class Message(db.Model):
@@ -23,3 +24,27 @@ class Message(db.Model):
     deleted_by = db.Column(
         db.Integer, index=True
     )  # if deleted by both, the message will not exist
+
+    __ts_vector__ = db.deferred(
+        db.Column(
+            TSVector(),
+            db.Computed("to_tsvector('english', body)", persisted=True),
+        )
+    )
+
+    __table_args__ = (
+        db.Index("ix_message___ts_vector__", "__ts_vector__", postgresql_using="gin"),
+        db.Index(
+            "ix_messages_conversation_id_created_at_id",
+            conversation_id,
+            created_at,
+            id,
+        ),
+        db.Index(
+            "ix_messages_unread",
+            conversation_id,
+            created_at,
+            id,
+            postgresql_where=read.is_(None),
+        ),
+    )
@@ -1,6 +1,9 @@
 from datetime import datetime
 from enum import Enum
+from typing import Optional
 
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import aliased
 
 from app import db
 
@@ -10,6 +13,8 @@ class FriendState(Enum):
     REQUESTED = "REQUESTED"
     ACCEPTED = "ACCEPTED"
     BLOCKED = "BLOCKED"
+    # blocked by the other user, never sent to the client
+    BLOCKEE = "BLOCKEE"
 
 
 class RelationshipType(Enum):
@@ -22,7 +27,7 @@ class Relationship(db.Model):
     requester_id = db.Column(
         db.Integer, db.ForeignKey("users.id", ondelete="CASCADE")
     )  # requester
-    addressee_id = db.Column(db.Integer, index=True)  # requestee
+    addressee_id = db.Column(db.Integer)  # requestee
     user = db.relationship("User", back_populates="relationships")
     relationship_type = db.Column(db.Enum(RelationshipType))
     created_at = db.Column(db.DateTime(), default=datetime.utcnow)
@@ -32,4 +37,69 @@ class Relationship(db.Model):
             requester_id,
             addressee_id,
         ),
+        # edges of one type in either direction, answered from the index alone
+        db.Index(
+            "ix_relationships_requester_id_type",
+            requester_id,
+            relationship_type,
+            addressee_id,
+        ),
+        db.Index(
+            "ix_relationships_addressee_id_type",
+            addressee_id,
+            relationship_type,
+            requester_id,
+        ),
     )
+
+    @classmethod
+    def get_state(cls, user_id: int, other_id: int) -> Optional[FriendState]:
+        """The relationship with the other user as the user sees it"""
+        edges = {
+            (requester_id == user_id, relationship_type)
+            for requester_id, relationship_type in db.session.query(
+                cls.requester_id, cls.relationship_type
+            ).filter(
+                or_(
+                    and_(cls.requester_id == user_id, cls.addressee_id == other_id),
+                    and_(cls.requester_id == other_id, cls.addressee_id == user_id),
+                )
+            )
+        }
+
+        added = (True, RelationshipType.FRIEND) in edges
+        added_by = (False, RelationshipType.FRIEND) in edges
+
+        if (False, RelationshipType.BLOCK) in edges:
+            return FriendState.BLOCKEE
+        elif added and added_by:
+            return FriendState.ACCEPTED
+        elif added:
+            return FriendState.REQUESTED
+        elif added_by:
+            return FriendState.REQUESTEE
+        elif (True, RelationshipType.BLOCK) in edges:
+            return FriendState.BLOCKED
+
+        return None
+
+    @classmethod
+    def count_friends(cls, user_id: int) -> int:
+        reverse = aliased(cls)
+        return (
+            db.session.query(func.count())
+            .select_from(cls)
+            .join(
+                reverse,
+                and_(
+                    reverse.requester_id == cls.addressee_id,
+                    reverse.addressee_id == cls.requester_id,
+                    reverse.relationship_type == RelationshipType.FRIEND,
+                ),
+            )
+            .filter(
+                cls.requester_id == user_id,
+                cls.relationship_type == RelationshipType.FRIEND,
+            )
+            .scalar()
+        )
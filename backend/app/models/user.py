@@ -5,12 +5,13 @@ from flask import current_app
 from flask_login import UserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from sqlalchemy import Index
+from sqlalchemy.orm import make_transient_to_detached
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from app import db, login_manager
 
 from app.models.ts_vector import TSVector
-from app.utils import get_test_emails
+from app.utils import is_test_email, run_blocking, user_cache
 
 
 class User(UserMixin, db.Model):
@@ -41,6 +42,27 @@ class User(UserMixin, db.Model):
 
     __table_args__ = (
         Index("ix_user___ts_vector__", __ts_vector__, postgresql_using="gin"),
+        # the trigram indexes on username and name are only created by their
+        # migration, as they need the pg_trgm extension
+    )
+
+    # columns read by to_minimal, for queries that only list users
+    MINIMAL_COLUMNS = (
+        "id",
+        "email",
+        "username",
+        "name",
+        "location",
+        "about_me",
+        "member_since",
+        "last_seen",
+        "avatar_hash",
+    )
+    # columns cached for the user loader, never the password hash. last_seen
+    # is left out as every flush changes it, it is loaded when it is read.
+    IDENTITY_COLUMNS = (
+        *(column for column in MINIMAL_COLUMNS if column != "last_seen"),
+        "confirmed",
     )
 
     def __init__(self, **kwargs):
@@ -55,10 +77,11 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # PBKDF2 holds the CPU for tens of milliseconds
+        self.password_hash = run_blocking(generate_password_hash, password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return run_blocking(check_password_hash, self.password_hash, password)
 
     def generate_confirmation_token(self, expiration=3600):
         s = Serializer(current_app.config["SECRET_KEY"], expiration)
@@ -120,10 +143,6 @@ class User(UserMixin, db.Model):
         db.session.add(self)
         return True
 
-    def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
-
     def gravatar_hash(self):
         return hashlib.md5(self.email.lower().encode("utf-8")).hexdigest()
 
@@ -132,6 +151,27 @@ class User(UserMixin, db.Model):
         _hash = self.avatar_hash or self.gravatar_hash()
         return f"{url}/{_hash}?s={size}&d={default}&r={rating}"
 
+    def to_identity(self):
+        identity = {column: getattr(self, column) for column in self.IDENTITY_COLUMNS}
+        if identity["member_since"] is not None:
+            identity["member_since"] = identity["member_since"].isoformat()
+        return identity
+
+    @classmethod
+    def from_identity(cls, identity):
+        """
+        The user in the session without a query, the columns left out of
+        the identity are loaded on first access
+        """
+        user = cls.__mapper__.class_manager.new_instance()
+        for column, value in identity.items():
+            if column == "member_since" and value is not None:
+                value = datetime.fromisoformat(value)
+            setattr(user, column, value)
+
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
     def to_minimal(self, private=False):
         json_user = {
             "id": self.id,
@@ -140,7 +180,7 @@ class User(UserMixin, db.Model):
             "location": self.location,
             "aboutMe": self.about_me,
             "gravatar": self.gravatar(default="robohash", rating="x")
-            if self.email in get_test_emails()
+            if is_test_email(self.email)
             else self.gravatar(),
         }
 
@@ -172,4 +212,11 @@ class User(UserMixin, db.Model):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    version, identity = user_cache.get(user_id)
+    if identity is not None:
+        return User.from_identity(identity)
+
+    user = User.query.get(user_id)
+    if user is not None:
+        user_cache.put(user_id, version, user.to_identity())
+    return user
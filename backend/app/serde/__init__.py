@@ -1,4 +1,11 @@
-from marshmallow import Schema, ValidationError, fields, post_load, pre_load
+from marshmallow import (
+    Schema,
+    ValidationError,
+    fields,
+    post_load,
+    pre_load,
+    validates_schema,
+)
 
 from app.models.user import User
 from app.serde.basic_schema import BasicSchema
@@ -14,8 +21,19 @@ class Messages(BasicSchema):
     ids = fields.List(fields.UUID)
 
 
+class ReadMessagesSchema(BasicSchema):
+    ids = fields.List(fields.UUID)
+    up_to = fields.UUID()
+
+    @validates_schema
+    def validate_mode(self, data, **kwargs):
+        if ("ids" in data) == ("up_to" in data):
+            raise ValidationError("Provide either ids or upTo.")
+
+
 class MessageSchema(BasicSchema):
-    id = fields.UUID(dump_only=True)
+    # chosen by the client when it sends the message, so retries are idempotent
+    id = fields.UUID()
     sender_id = fields.Integer()
     body = fields.Str()
     read = fields.Boolean()
@@ -26,6 +44,8 @@ class ConversationSchema(BasicSchema):
     id = fields.UUID(dump_only=True)
     sender_id = fields.Integer()
     recipient_id = fields.Integer()
+    last_message_at = fields.DateTime(dump_only=True)
+    last_message_preview = fields.Str(dump_only=True)
 
 
 class NewConversationSchema(BasicSchema):
@@ -1,6 +1,8 @@
 import os
 import logging
-from app import mail, make_celery, create_celery_app
+from app import db, mail, make_celery, create_celery_app
+from app.models.friend_suggestion import FriendSuggestion
+from app.utils import last_seen
 
 
 logger = logging.getLogger(__name__)
@@ -15,3 +17,17 @@ def send_async_email(msg):
         mail.send(msg)
     except Exception as e:
         logger.exception(e)
+
+
+@celery.task
+def refresh_friend_suggestions(user_ids=None):
+    """Recomputes the suggestions of the given users, or of everyone"""
+    FriendSuggestion.recompute(user_ids)
+    db.session.commit()
+
+
+@celery.task
+def flush_last_seen():
+    """Writes the last_seen buffered since the previous flush to the users"""
+    flushed = last_seen.flush()
+    logger.info("Flushed last_seen of %s users" % flushed)
@@ -1,4 +1,7 @@
 import os
+from functools import lru_cache
+
+from eventlet import patcher, tpool
 from flask import current_app
 
 
@@ -9,6 +12,20 @@ def extract_all_errors(err):
     return errors
 
 
+def get_redis():
+    return current_app.config["SESSION_REDIS"]
+
+
+def run_blocking(func, *args, **kwargs):
+    """
+    Runs CPU bound work on a native thread when eventlet has patched the
+    process, so the hub keeps serving other requests and socket events
+    """
+    if patcher.is_monkey_patched("thread"):
+        return tpool.execute(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+
 def get_test_emails():
     with open(f"{current_app.root_path}/test_data/accounts.txt") as f:
         test_emails = f.read().splitlines()
@@ -16,6 +33,17 @@ def get_test_emails():
     return test_emails
 
 
+@lru_cache(maxsize=None)
+def _load_test_emails(path):
+    with open(path) as f:
+        return frozenset(f.read().splitlines())
+
+
+def is_test_email(email):
+    """Test accounts get robohash avatars, read once per process"""
+    return email in _load_test_emails(f"{current_app.root_path}/test_data/accounts.txt")
+
+
 def get_test_conversation():
     with open(f"{current_app.root_path}/test_data/conversations.txt") as f:
         test_conversations = f.read().splitlines()
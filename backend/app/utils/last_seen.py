@@ -0,0 +1,55 @@
+"""
+Write-behind buffer of the users' last_seen, so authenticated requests stay
+read-only. Requests record the time they saw a user in Redis and a periodic
+task writes the latest times to Postgres in one batch.
+"""
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, update
+
+from app import db
+from app.models.user import User
+from app.utils import get_redis
+
+# user id -> timestamp of the latest request, waiting for the next flush
+PENDING = "last_seen:pending"
+# the pending times being written by a flush
+FLUSHING = "last_seen:flushing"
+
+
+def touch(user_id):
+    get_redis().zadd(PENDING, {user_id: time.time()})
+
+
+def flush():
+    """Writes the buffered times to the users, returns how many were written"""
+    redis = get_redis()
+
+    with redis.pipeline() as pipe:
+        # times left by a flush that failed are merged rather than lost
+        pipe.zunionstore(FLUSHING, [FLUSHING, PENDING], aggregate="MAX")
+        pipe.delete(PENDING)
+        pipe.zrange(FLUSHING, 0, -1, withscores=True)
+        _, _, seen = pipe.execute()
+
+    if not seen:
+        return 0
+
+    db.session.execute(
+        update(User.__table__)
+        .where(User.__table__.c.id == bindparam("user_id"))
+        .values(last_seen=bindparam("last_seen")),
+        [
+            {
+                "user_id": int(user_id),
+                "last_seen": datetime.utcfromtimestamp(timestamp),
+            }
+            for user_id, timestamp in seen
+        ],
+    )
+    db.session.commit()
+    # last_seen is not part of the cached identities, they stay valid
+    redis.delete(FLUSHING)
+
+    return len(seen)
@@ -0,0 +1,157 @@
+"""
+Per user adjacency sets of the relationships graph, kept in Redis so the
+checks on hot paths skip Postgres. Each user has the ids of the users they
+added or blocked (out) and of the users who added or blocked them (in).
+
+A user's sets are loaded from the database on first use and written through
+after every commit that changes an edge touching them.
+"""
+from flask import current_app
+from redis import WatchError
+from sqlalchemy import and_, or_
+
+from app.models.relationship import Relationship, RelationshipType
+from app.utils import get_redis
+
+# user id, relationship type, direction -> ids of the users at the other end
+EDGES = "relationships:%s:%s:%s"
+# user id -> set once the user's edges have been loaded from the database
+LOADED = "relationships:%s:loaded"
+
+DIRECTIONS = ("out", "in")
+
+
+def _keys(user_id):
+    return [
+        EDGES % (user_id, relationship_type.name, direction)
+        for relationship_type in RelationshipType
+        for direction in DIRECTIONS
+    ]
+
+
+def _load(user_id):
+    redis = get_redis()
+    keys = _keys(user_id)
+    ttl = current_app.config["RELATIONSHIP_CACHE_TTL"]
+
+    with redis.pipeline() as pipe:
+        while True:
+            # an edge written through while the rows are read modifies one of
+            # the sets, which discards this load and reads the rows again
+            pipe.watch(*keys)
+            relationships = Relationship.query.filter(
+                or_(
+                    Relationship.requester_id == user_id,
+                    Relationship.addressee_id == user_id,
+                )
+            ).all()
+
+            pipe.multi()
+            pipe.delete(*keys)
+            for relationship in relationships:
+                if relationship.requester_id == user_id:
+                    direction, other_id = "out", relationship.addressee_id
+                else:
+                    direction, other_id = "in", relationship.requester_id
+                key = EDGES % (user_id, relationship.relationship_type.name, direction)
+                pipe.sadd(key, other_id)
+            for key in keys:
+                pipe.expire(key, ttl)
+            pipe.set(LOADED % user_id, 1, ex=ttl)
+            try:
+                pipe.execute()
+                return
+            except WatchError:
+                continue
+
+
+def _ensure_loaded(*user_ids):
+    loaded = get_redis().mget([LOADED % user_id for user_id in user_ids])
+    for user_id, is_loaded in zip(user_ids, loaded):
+        if not is_loaded:
+            _load(user_id)
+
+
+def get_edges(user_id, relationship_type):
+    """Returns the ids of the users at the other end of out and in edges"""
+    _ensure_loaded(user_id)
+
+    with get_redis().pipeline() as pipe:
+        for direction in DIRECTIONS:
+            pipe.smembers(EDGES % (user_id, relationship_type.name, direction))
+        out_ids, in_ids = pipe.execute()
+
+    return {int(id) for id in out_ids}, {int(id) for id in in_ids}
+
+
+def has_edge(requester_id, addressee_id, relationship_type):
+    _ensure_loaded(requester_id)
+
+    return bool(
+        get_redis().sismember(
+            EDGES % (requester_id, relationship_type.name, "out"), addressee_id
+        )
+    )
+
+
+def are_friends(user_id, other_id):
+    """Friends have added each other"""
+    _ensure_loaded(user_id)
+
+    friend = RelationshipType.FRIEND.name
+    with get_redis().pipeline() as pipe:
+        pipe.sismember(EDGES % (user_id, friend, "out"), other_id)
+        pipe.sismember(EDGES % (user_id, friend, "in"), other_id)
+        added, added_by = pipe.execute()
+
+    return bool(added and added_by)
+
+
+def refresh_pair(user_id, other_id):
+    """
+    Writes the edges between two users through to both their sets, call it
+    after committing any change to the relationships between them
+    """
+    relationships = Relationship.query.filter(
+        or_(
+            and_(
+                Relationship.requester_id == user_id,
+                Relationship.addressee_id == other_id,
+            ),
+            and_(
+                Relationship.requester_id == other_id,
+                Relationship.addressee_id == user_id,
+            ),
+        )
+    ).all()
+    edges = {
+        (relationship.requester_id, relationship.relationship_type)
+        for relationship in relationships
+    }
+
+    ttl = current_app.config["RELATIONSHIP_CACHE_TTL"]
+    with get_redis().pipeline() as pipe:
+        for requester_id, addressee_id in ((user_id, other_id), (other_id, user_id)):
+            for relationship_type in RelationshipType:
+                out_key = EDGES % (requester_id, relationship_type.name, "out")
+                in_key = EDGES % (addressee_id, relationship_type.name, "in")
+                if (requester_id, relationship_type) in edges:
+                    pipe.sadd(out_key, addressee_id)
+                    pipe.sadd(in_key, requester_id)
+                else:
+                    pipe.srem(out_key, addressee_id)
+                    pipe.srem(in_key, requester_id)
+                pipe.expire(out_key, ttl)
+                pipe.expire(in_key, ttl)
+        pipe.execute()
+
+
+def forget_user(user_id, other_ids):
+    """
+    Drops a deleted user and the users they had edges with, whose sets are
+    loaded again from the rows the deletion left
+    """
+    with get_redis().pipeline() as pipe:
+        for id in (user_id, *other_ids):
+            pipe.delete(LOADED % id, *_keys(id))
+        pipe.execute()
@@ -0,0 +1,96 @@
+"""
+Prefix index of usernames and names for the search typeahead, kept in
+Redis so suggestions never reach Postgres.
+
+Every word of a user's username and name is a member of one sorted set,
+all with the same score so ZRANGEBYLEX walks them in order. Members end with
+the user id, the users' payloads are kept in a hash next to it.
+"""
+import json
+
+from app.utils import get_redis
+
+# "<word>\x00<user id>" members, scored 0
+PREFIXES = "search:prefixes"
+# user id -> to_minimal of the user
+USERS = "search:users"
+# user id -> members of the user in PREFIXES
+WORDS = "search:words"
+
+SEPARATOR = "\x00"
+# fetched per round trip while blocked users are being skipped
+BATCH_SIZE = 50
+
+
+def _words(user):
+    words = {user.username.lower()}
+    if user.name:
+        words.update(user.name.lower().split())
+        words.add(user.name.lower())
+    return words
+
+
+def index_user(user):
+    """Adds or refreshes a user, call it after committing any change to them"""
+    redis = get_redis()
+    previous = redis.hget(WORDS, user.id)
+    members = [f"{word}{SEPARATOR}{user.id}" for word in _words(user)]
+
+    with redis.pipeline() as pipe:
+        if previous:
+            pipe.zrem(PREFIXES, *json.loads(previous))
+        pipe.zadd(PREFIXES, {member: 0 for member in members})
+        pipe.hset(WORDS, user.id, json.dumps(members))
+        pipe.hset(USERS, user.id, json.dumps(user.to_minimal()))
+        pipe.execute()
+
+
+def remove_user(user_id):
+    redis = get_redis()
+    previous = redis.hget(WORDS, user_id)
+
+    with redis.pipeline() as pipe:
+        if previous:
+            pipe.zrem(PREFIXES, *json.loads(previous))
+        pipe.hdel(WORDS, user_id)
+        pipe.hdel(USERS, user_id)
+        pipe.execute()
+
+
+def rebuild(users):
+    """Replaces the whole index with the given users"""
+    get_redis().delete(PREFIXES, USERS, WORDS)
+    for user in users:
+        index_user(user)
+
+
+def suggest(prefix, limit=10, exclude_ids=()):
+    """The first users, in word order, with a word starting with the prefix"""
+    prefix = prefix.strip().lower()
+    if not prefix or SEPARATOR in prefix:
+        return []
+
+    redis = get_redis()
+    # the lex range of the prefix, compared byte by byte
+    low = b"[" + prefix.encode()
+    high = low + b"\xff"
+    exclude_ids = {str(id) for id in exclude_ids}
+    user_ids = []
+    offset = 0
+
+    while len(user_ids) < limit:
+        members = redis.zrangebylex(PREFIXES, low, high, start=offset, num=BATCH_SIZE)
+        for member in members:
+            user_id = member.decode().rsplit(SEPARATOR, 1)[1]
+            if user_id not in exclude_ids and user_id not in user_ids:
+                user_ids.append(user_id)
+                if len(user_ids) == limit:
+                    break
+        if len(members) < BATCH_SIZE:
+            break
+        offset += BATCH_SIZE
+
+    if not user_ids:
+        return []
+
+    return [json.loads(user) for user in redis.hmget(USERS, user_ids) if user]
@@ -0,0 +1,49 @@
+"""
+Identity of the logged in users, the columns the user loader needs, kept in
+Redis so authenticated requests skip the primary key query.
+
+Each user has a version, incremented after every commit that changes their
+row. Entries are stored with the version they were read at and only used
+while it is still current, so an entry read before a change is never served
+after it.
+"""
+import json
+
+from flask import current_app
+
+from app.utils import get_redis
+
+# user id -> incremented on every change to the user
+VERSION = "users:%s:version"
+# user id -> the version and identity of the user
+IDENTITY = "users:%s:identity"
+
+
+def get(user_id):
+    """Returns the current version of a user and their identity, if cached"""
+    version, entry = get_redis().mget(VERSION % user_id, IDENTITY % user_id)
+    version = int(version or 0)
+
+    if entry is not None:
+        entry = json.loads(entry)
+        if entry["version"] == version:
+            return version, entry["identity"]
+
+    return version, None
+
+
+def put(user_id, version, identity):
+    """Caches an identity read at the version get returned"""
+    get_redis().set(
+        IDENTITY % user_id,
+        json.dumps({"version": version, "identity": identity}),
+        ex=current_app.config["USER_CACHE_TTL"],
+    )
+
+
+def invalidate(*user_ids):
+    """Call it after committing any change to the users' rows"""
+    with get_redis().pipeline() as pipe:
+        for user_id in user_ids:
+            pipe.incr(VERSION % user_id)
+        pipe.execute()
@@ -59,11 +59,28 @@ def setup_db():
         print(str(e))
 
 
+@app.cli.command("refresh-suggestions")
+def refresh_suggestions():
+    """Recomputes every user's friend suggestions"""
+    friend_suggestion.FriendSuggestion.recompute()
+    db.session.commit()
+    print("Friend suggestions refreshed")
+
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index():
+    """Indexes every user for the search typeahead"""
+    from app.utils import search_index
+
+    search_index.rebuild(user.User.query.all())
+    print("Search index rebuilt")
+
+
 @app.cli.command("setup-test-accounts")
 @click.argument("delete")
 def setup_test_accounts(delete):
     try:
-        from app.utils import get_test_emails, get_test_conversation
+        from app.utils import get_test_emails, get_test_conversation, search_index
 
         test_emails = get_test_emails()
         # create users
@@ -77,6 +94,7 @@ def setup_test_accounts(delete):
                 ).delete()
 
                 db.session.delete(_user)
+                search_index.remove_user(_user.id)
 
             db.session.commit()
 
@@ -97,6 +115,7 @@ def setup_test_accounts(delete):
             )
             db.session.add(_user)
             db.session.commit()
+            search_index.index_user(_user)
 
         if delete == "delete":
             return
@@ -158,8 +177,14 @@ def setup_test_accounts(delete):
             ]
 
             db.session.add_all(messages)
+            db.session.flush()
+            # the summary is kept by the send path, which is skipped here
+            conversation.Conversation.refresh_summaries({_conversation.id})
             db.session.commit()
 
+        friend_suggestion.FriendSuggestion.recompute()
+        db.session.commit()
+
         print("Successfully created test accounts")
     except Exception as e:
         print("Failed to create tests accounts")
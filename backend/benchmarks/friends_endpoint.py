@@ -0,0 +1,94 @@
+"""
+Times GET /api/relationships/friends for a user with hundreds of friends,
+through the Flask test client against the test database.
+
+    python benchmarks/friends_endpoint.py --friends 500 --requests 50
+
+Uses the TESTING configuration, so TEST_DATABASE_URL and the Redis variables
+must be set. The tables of the test database are created and dropped again.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.models.relationship import Relationship, RelationshipType  # noqa: E402
+from app.models.user import User  # noqa: E402
+from app.utils import get_redis  # noqa: E402
+
+PASSWORD = "password"
+
+
+def setup(friends):
+    db.create_all()
+    user = User(email="bench@example.com", username="bench", confirmed=True)
+    user.password = PASSWORD
+    # hashing once is enough, the friends never log in
+    others = [
+        User(
+            email=f"friend{n}@example.com",
+            username=f"friend{n}",
+            name=f"Friend {n}",
+            password_hash=user.password_hash,
+            confirmed=True,
+        )
+        for n in range(friends)
+    ]
+    db.session.add_all([user, *others])
+    db.session.flush()
+
+    for other in others:
+        for requester_id, addressee_id in ((user.id, other.id), (other.id, user.id)):
+            db.session.add(
+                Relationship(
+                    requester_id=requester_id,
+                    addressee_id=addressee_id,
+                    relationship_type=RelationshipType.FRIEND,
+                )
+            )
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--friends", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app("TESTING")
+    with app.app_context():
+        for key in get_redis().scan_iter("relationships:*"):
+            get_redis().delete(key)
+        setup(args.friends)
+        try:
+            client = app.test_client(use_cookies=True)
+            client.post(
+                "/api/users/login",
+                json={"emailOrUsername": "bench", "password": PASSWORD},
+            )
+            # the first request loads the relationship cache
+            response = client.get("/api/relationships/friends")
+            assert len(response.json["friends"]) == args.friends
+
+            timings = []
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                client.get("/api/relationships/friends")
+                timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+    print(
+        f"{args.friends} friends, {args.requests} requests: "
+        f"median {statistics.median(timings):.2f} ms, "
+        f"min {min(timings):.2f} ms, max {max(timings):.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Measures how late a message delivery loop runs on the eventlet hub while a
+storm of logins hashes and verifies passwords, as in the eventlet worker.
+
+    python benchmarks/hashing_latency.py --logins 20 --concurrency 10
+
+The delivery loop wakes every 10 ms, as a socket.io emit would, and records
+how long past its deadline it ran. The storm is run twice, with the hashing
+on the hub and with it on eventlet's thread pool. Prints the results as JSON.
+"""
+import eventlet
+
+eventlet.monkey_patch()
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import statistics  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+from unittest import mock  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# every model, for the mappers of User's relationships
+from app.models import *  # noqa: E402, F401, F403
+from app.models.user import User  # noqa: E402
+
+INTERVAL = 0.01
+
+
+def login(password_hash):
+    User(password_hash=password_hash).verify_password("password")
+
+
+def delivery_lateness(logins, concurrency, password_hash):
+    lateness = []
+    done = eventlet.event.Event()
+
+    def deliver():
+        while not done.ready():
+            deadline = time.perf_counter() + INTERVAL
+            eventlet.sleep(INTERVAL)
+            lateness.append((time.perf_counter() - deadline) * 1000)
+
+    deliverer = eventlet.spawn(deliver)
+    eventlet.sleep(INTERVAL * 5)
+
+    pool = eventlet.GreenPool(concurrency)
+    start = time.perf_counter()
+    for _ in range(logins):
+        pool.spawn(login, password_hash)
+    pool.waitall()
+    elapsed = time.perf_counter() - start
+
+    done.send()
+    deliverer.wait()
+    return {
+        "storm ms": round(elapsed * 1000, 2),
+        "median late ms": round(statistics.median(lateness), 2),
+        "max late ms": round(max(lateness), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    password_hash = User(password="password").password_hash
+
+    def inline(func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    with mock.patch("app.models.user.run_blocking", inline):
+        on_hub = delivery_lateness(args.logins, args.concurrency, password_hash)
+    on_threads = delivery_lateness(args.logins, args.concurrency, password_hash)
+
+    print(json.dumps({"on hub": on_hub, "on threads": on_threads}))
+
+
+if __name__ == "__main__":
+    main()
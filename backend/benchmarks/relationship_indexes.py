@@ -0,0 +1,174 @@
+"""
+Compares the plans of the relationship lookups before and after the
+relationship type indexes, on a generated graph in a scratch schema.
+
+    python benchmarks/relationship_indexes.py --edges 1000000
+
+Connects to the database configured by the POSTGRES_* variables unless
+--database-url is given. The relationshiptype enum must exist, run the
+migrations first. The scratch schema is dropped afterwards.
+"""
+import argparse
+import json
+import os
+import sys
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils import get_database_uri  # noqa: E402
+
+SCHEMA = "benchmark_relationships"
+
+BEFORE = [
+    "CREATE INDEX ix_relationships_addressee_id ON {schema}.relationships "
+    "(addressee_id)",
+]
+AFTER = [
+    "DROP INDEX {schema}.ix_relationships_addressee_id",
+    "CREATE INDEX ix_relationships_requester_id_type ON {schema}.relationships "
+    "(requester_id, relationship_type, addressee_id)",
+    "CREATE INDEX ix_relationships_addressee_id_type ON {schema}.relationships "
+    "(addressee_id, relationship_type, requester_id)",
+]
+
+QUERIES = {
+    # search_all and search_user: who blocked the viewer
+    "blocked by": "SELECT requester_id FROM {schema}.relationships "
+    "WHERE addressee_id = :user_id AND relationship_type = 'BLOCK'",
+    # friend requests received
+    "added by": "SELECT requester_id FROM {schema}.relationships "
+    "WHERE addressee_id = :user_id AND relationship_type = 'FRIEND'",
+    # friends, both directions of a friendship
+    "friends": "SELECT r.addressee_id FROM {schema}.relationships r "
+    "JOIN {schema}.relationships b ON b.requester_id = r.addressee_id "
+    "AND b.addressee_id = r.requester_id AND b.relationship_type = 'FRIEND' "
+    "WHERE r.requester_id = :user_id AND r.relationship_type = 'FRIEND'",
+    # count_friends on a profile
+    "count friends": "SELECT count(*) FROM {schema}.relationships r "
+    "JOIN {schema}.relationships b ON b.requester_id = r.addressee_id "
+    "AND b.addressee_id = r.requester_id AND b.relationship_type = 'FRIEND' "
+    "WHERE r.requester_id = :user_id AND r.relationship_type = 'FRIEND'",
+}
+
+
+def setup(conn, users, edges):
+    conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    conn.execute(
+        text(
+            f"CREATE TABLE {SCHEMA}.relationships ("
+            "requester_id integer NOT NULL, "
+            "addressee_id integer NOT NULL, "
+            "relationship_type relationshiptype, "
+            "created_at timestamp DEFAULT now(), "
+            "PRIMARY KEY (requester_id, addressee_id))"
+        )
+    )
+    # most edges are friendships, most of them accepted, which adds about
+    # three quarters of the first batch again as reverse edges
+    conn.execute(
+        text(
+            f"INSERT INTO {SCHEMA}.relationships "
+            "(requester_id, addressee_id, relationship_type) "
+            "SELECT requester_id, addressee_id, CASE WHEN random() < 0.05 "
+            "THEN 'BLOCK' ELSE 'FRIEND' END::relationshiptype "
+            "FROM (SELECT 1 + (random() * (:users - 1))::int AS requester_id, "
+            "1 + (random() * (:users - 1))::int AS addressee_id "
+            "FROM generate_series(1, :edges * 10 / 17)) edges "
+            "WHERE requester_id <> addressee_id "
+            "ON CONFLICT DO NOTHING"
+        ),
+        {"users": users, "edges": edges},
+    )
+    conn.execute(
+        text(
+            f"INSERT INTO {SCHEMA}.relationships "
+            "(requester_id, addressee_id, relationship_type) "
+            "SELECT addressee_id, requester_id, relationship_type "
+            f"FROM {SCHEMA}.relationships "
+            "WHERE relationship_type = 'FRIEND' AND random() < 0.8 "
+            "ON CONFLICT DO NOTHING"
+        )
+    )
+    return conn.execute(text(f"SELECT count(*) FROM {SCHEMA}.relationships")).scalar()
+
+
+def nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from nodes(child)
+
+
+def explain(conn, user_id):
+    results = {}
+    for name, query in QUERIES.items():
+        (plan,) = conn.execute(
+            text(
+                "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query.format(schema=SCHEMA)
+            ),
+            {"user_id": user_id},
+        ).scalar()
+        scans = [
+            node["Node Type"]
+            for node in nodes(plan["Plan"])
+            if "Scan" in node["Node Type"]
+        ]
+        results[name] = {
+            "scans": scans,
+            "heap fetches": sum(
+                node.get("Heap Fetches", 0) for node in nodes(plan["Plan"])
+            ),
+            "filtered": sum(
+                node.get("Rows Removed by Filter", 0) for node in nodes(plan["Plan"])
+            ),
+            "ms": plan["Execution Time"],
+        }
+    return results
+
+
+def busiest_user(conn):
+    return conn.execute(
+        text(
+            f"SELECT addressee_id FROM {SCHEMA}.relationships "
+            "GROUP BY addressee_id ORDER BY count(*) DESC LIMIT 1"
+        )
+    ).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--edges", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--keep", action="store_true", help="keep the schema")
+    args = parser.parse_args()
+
+    engine = create_engine(
+        args.database_url or get_database_uri(), isolation_level="AUTOCOMMIT"
+    )
+    with engine.connect() as conn:
+        total = setup(conn, args.users, args.edges)
+        print(f"{total} edges between {args.users} users")
+
+        runs = {}
+        try:
+            for label, statements in (("before", BEFORE), ("after", AFTER)):
+                for statement in statements:
+                    conn.execute(text(statement.format(schema=SCHEMA)))
+                # sets the visibility map index-only scans rely on
+                conn.execute(text(f"VACUUM ANALYZE {SCHEMA}.relationships"))
+                runs[label] = explain(conn, busiest_user(conn))
+        finally:
+            if not args.keep:
+                conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+
+    for name in QUERIES:
+        print(f"\n{name}")
+        for label, results in runs.items():
+            print(f"  {label:<7}{json.dumps(results[name])}")
+
+
+if __name__ == "__main__":
+    main()
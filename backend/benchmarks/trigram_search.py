@@ -0,0 +1,102 @@
+"""
+Times the trigram fallback of the user search on generated users in a
+scratch schema, with the trigram indexes of the migration.
+
+    python benchmarks/trigram_search.py --users 1000000
+
+Connects to the database configured by the POSTGRES_* variables unless
+--database-url is given. Needs the pg_trgm extension. The scratch schema is
+dropped afterwards. With --max-ms it exits with an error when any term takes
+longer than that.
+"""
+import argparse
+import os
+import sys
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils import get_database_uri  # noqa: E402
+
+SCHEMA = "benchmark_trigram_search"
+
+# the query _similar_users runs
+QUERY = (
+    "SELECT id, username, name FROM {schema}.users "
+    "WHERE username % :term OR name % :term "
+    "ORDER BY greatest(similarity(username, :term), similarity(name, :term)) "
+    "DESC, id LIMIT 10"
+)
+
+TERMS = ["jdoe_", "jon smiht", "mary4", "xq"]
+
+
+def setup(conn, users):
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    conn.execute(
+        text(
+            f"CREATE TABLE {SCHEMA}.users ("
+            "id serial PRIMARY KEY, username varchar(64), name varchar(64))"
+        )
+    )
+    # usernames like jdoe_123 from a small pool of first and last names
+    conn.execute(
+        text(
+            f"INSERT INTO {SCHEMA}.users (username, name) "
+            "SELECT lower(left(first, 1) || last) || '_' || n, first || ' ' || last "
+            "FROM (SELECT n, "
+            "(ARRAY['John','Mary','Paul','Anna','Jon','Lena','Omar','Yuki'])"
+            "[1 + n % 8] AS first, "
+            "(ARRAY['Doe','Smith','Jones','Brown','Garcia','Chen','Novak'])"
+            "[1 + (n / 8) % 7] || (n / 56)::text AS last "
+            "FROM generate_series(1, :users) n) generated"
+        ),
+        {"users": users},
+    )
+    for column in ("username", "name"):
+        conn.execute(
+            text(
+                f"CREATE INDEX ix_users_{column}_trgm ON {SCHEMA}.users "
+                f"USING gin ({column} gin_trgm_ops)"
+            )
+        )
+    conn.execute(text(f"VACUUM ANALYZE {SCHEMA}.users"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--keep", action="store_true", help="keep the schema")
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    engine = create_engine(
+        args.database_url or get_database_uri(), isolation_level="AUTOCOMMIT"
+    )
+    slowest = 0
+    with engine.connect() as conn:
+        setup(conn, args.users)
+        try:
+            for term in TERMS:
+                (plan,) = conn.execute(
+                    text(
+                        "EXPLAIN (ANALYZE, FORMAT JSON) " + QUERY.format(schema=SCHEMA)
+                    ),
+                    {"term": term},
+                ).scalar()
+                print(f"{term!r:<14}{plan['Execution Time']:8.2f} ms")
+                slowest = max(slowest, plan["Execution Time"])
+        finally:
+            if not args.keep:
+                conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+
+    if args.max_ms is not None and slowest > args.max_ms:
+        sys.exit(f"slowest term took {slowest:.2f} ms, over {args.max_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
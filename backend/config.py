@@ -4,12 +4,27 @@ from datetime import timedelta
 
 from app.utils import get_database_uri, get_redis_uri
 
+# how stale the users' last_seen may get, the period of its write-behind flush
+LAST_SEEN_FLUSH_INTERVAL = timedelta(
+    seconds=int(os.environ.get("LAST_SEEN_FLUSH_SECONDS", 60))
+)
 
 CELERY_CONFIG = {
     "broker_url": get_redis_uri(),
     "result_backend": get_redis_uri(),
     "imports": ("app.tasks",),
     "accept_content": ["json", "pickle"],
+    "beat_schedule": {
+        # catches up on changes whose incremental refresh was lost
+        "refresh-friend-suggestions": {
+            "task": "app.tasks.refresh_friend_suggestions",
+            "schedule": timedelta(hours=6),
+        },
+        "flush-last-seen": {
+            "task": "app.tasks.flush_last_seen",
+            "schedule": LAST_SEEN_FLUSH_INTERVAL,
+        },
+    },
 }
 
 
@@ -26,6 +41,20 @@ class Config:
     SESSION_USE_SIGNER = True
     SESSION_REDIS = redis.from_url(get_redis_uri())
     PERMANENT_SESSION_LIFETIME = timedelta(minutes=20)
+    SOCKETIO_MESSAGE_QUEUE = get_redis_uri()
+    SOCKETIO_EVENT_BUFFER_SIZE = 200
+    SOCKETIO_EVENT_BUFFER_TTL = timedelta(days=1)
+    # clients that saw the latest event skip the resync while it is kept
+    SOCKETIO_EVENT_HEAD_TTL = timedelta(days=30)
+    # how often workers refresh their connected clients, and how long a
+    # client is kept once its worker stops, e.g. when killed in a deploy
+    SOCKETIO_CLIENT_HEARTBEAT = timedelta(seconds=30)
+    SOCKETIO_CLIENT_TIMEOUT = timedelta(minutes=2)
+    RELATIONSHIP_CACHE_TTL = timedelta(days=1)
+    USER_CACHE_TTL = timedelta(hours=1)
+    # fuzzy user search when full text finds nothing, requires pg_trgm and
+    # the trigram indexes of its migration, so it is opt-in
+    SEARCH_TRIGRAM_FALLBACK = os.environ.get("SEARCH_TRIGRAM_FALLBACK") == "1"
 
     @staticmethod
     def init_app(app):
@@ -42,6 +71,9 @@ class TestConfig(Config):
     TESTING = True
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URL")
+    SOCKETIO_MESSAGE_QUEUE = None
+    # the test database is created from the models, without extensions
+    SEARCH_TRIGRAM_FALLBACK = False
 
 
 class ProductionConfig(Config):
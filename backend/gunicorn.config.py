@@ -4,6 +4,10 @@ load_dotenv()
 
 bind = "0.0.0.0:8000"
 worker_class = "eventlet"
+# gunicorn workers share one listening socket, so a socket.io client could
+# not be kept on the worker holding its session. Scale out with more flask
+# replicas instead, nginx pins each client to one of them and the redis
+# message queue fans events out between them.
 workers = 1
 capture_output = True
 reload = True
@@ -0,0 +1,41 @@
+"""full text search messages
+
+Revision ID: 38f56405cc1b
+Revises: 872d4a5bf592
+Create Date: 2026-10-18 10:03:27.561942
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "38f56405cc1b"
+down_revision = "872d4a5bf592"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "messages",
+        sa.Column(
+            "__ts_vector__",
+            postgresql.TSVECTOR(),
+            sa.Computed("to_tsvector('english', body)", persisted=True),
+            nullable=True,
+        ),
+    )
+    op.create_index(
+        "ix_message___ts_vector__",
+        "messages",
+        ["__ts_vector__"],
+        unique=False,
+        postgresql_using="gin",
+    )
+
+
+def downgrade():
+    op.drop_index("ix_message___ts_vector__", table_name="messages")
+    op.drop_column("messages", "__ts_vector__")
@@ -0,0 +1,44 @@
+"""relationship type indexes
+
+Revision ID: 3b7e0c5a91d2
+Revises: 5d9cf1afa60b
+Create Date: 2026-10-18 14:48:12.730594
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3b7e0c5a91d2"
+down_revision = "5d9cf1afa60b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_relationships_requester_id_type",
+        "relationships",
+        ["requester_id", "relationship_type", "addressee_id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_relationships_addressee_id_type",
+        "relationships",
+        ["addressee_id", "relationship_type", "requester_id"],
+        unique=False,
+    )
+    # covered by the leading column of the index above
+    op.drop_index("ix_relationships_addressee_id", table_name="relationships")
+
+
+def downgrade():
+    op.create_index(
+        "ix_relationships_addressee_id",
+        "relationships",
+        ["addressee_id"],
+        unique=False,
+    )
+    op.drop_index("ix_relationships_addressee_id_type", table_name="relationships")
+    op.drop_index("ix_relationships_requester_id_type", table_name="relationships")
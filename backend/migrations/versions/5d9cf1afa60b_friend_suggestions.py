@@ -0,0 +1,42 @@
+"""friend suggestions
+
+Revision ID: 5d9cf1afa60b
+Revises: f4d51593e103
+Create Date: 2026-10-18 14:02:41.518337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5d9cf1afa60b"
+down_revision = "f4d51593e103"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "friend_suggestions",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("suggested_id", sa.Integer(), nullable=False),
+        sa.Column("mutual_friends", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["suggested_id"], ["users.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "suggested_id"),
+    )
+    op.create_index(
+        "ix_friend_suggestions_user_id_mutual_friends",
+        "friend_suggestions",
+        ["user_id", sa.text("mutual_friends DESC"), "suggested_id"],
+        unique=False,
+    )
+    # filled by the periodic task, or right away with `flask refresh-suggestions`
+
+
+def downgrade():
+    op.drop_index(
+        "ix_friend_suggestions_user_id_mutual_friends", table_name="friend_suggestions"
+    )
+    op.drop_table("friend_suggestions")
@@ -0,0 +1,37 @@
+"""keyset index messages
+
+Revision ID: 872d4a5bf592
+Revises: f07c46e346be
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "872d4a5bf592"
+down_revision = "f07c46e346be"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_messages_conversation_id_created_at_id",
+        "messages",
+        ["conversation_id", "created_at", "id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_messages_unread",
+        "messages",
+        ["conversation_id", "created_at", "id"],
+        unique=False,
+        postgresql_where=sa.text("read IS NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_messages_unread", table_name="messages")
+    op.drop_index("ix_messages_conversation_id_created_at_id", table_name="messages")
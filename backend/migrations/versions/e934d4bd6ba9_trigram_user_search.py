@@ -0,0 +1,42 @@
+"""trigram user search
+
+Revision ID: e934d4bd6ba9
+Revises: 3b7e0c5a91d2
+Create Date: 2026-10-18 15:20:37.102846
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e934d4bd6ba9"
+down_revision = "3b7e0c5a91d2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        "ix_users_username_trgm",
+        "users",
+        ["username"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"username": "gin_trgm_ops"},
+    )
+    op.create_index(
+        "ix_users_name_trgm",
+        "users",
+        ["name"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"name": "gin_trgm_ops"},
+    )
+
+
+def downgrade():
+    op.drop_index("ix_users_name_trgm", table_name="users")
+    op.drop_index("ix_users_username_trgm", table_name="users")
+    # the extension is left installed, other objects may depend on it
@@ -0,0 +1,81 @@
+"""conversation participants key
+
+Revision ID: ea3ba9621601
+Revises: 38f56405cc1b
+Create Date: 2026-10-18 10:41:52.114367
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "ea3ba9621601"
+down_revision = "38f56405cc1b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "conversations",
+        sa.Column(
+            "least_user_id",
+            sa.Integer(),
+            sa.Computed("LEAST(sender_id, recipient_id)", persisted=True),
+            nullable=True,
+        ),
+    )
+    op.add_column(
+        "conversations",
+        sa.Column(
+            "greatest_user_id",
+            sa.Integer(),
+            sa.Computed("GREATEST(sender_id, recipient_id)", persisted=True),
+            nullable=True,
+        ),
+    )
+    # the check-then-insert race on conversation creation may have left more
+    # than one conversation for a pair, merge them into the oldest one
+    op.execute(
+        """
+        CREATE TEMPORARY TABLE duplicate_conversations ON COMMIT DROP AS
+        SELECT id, keep_id FROM (
+            SELECT id, first_value(id) OVER (
+                PARTITION BY least_user_id, greatest_user_id
+                ORDER BY created_at, id
+            ) AS keep_id
+            FROM conversations
+            WHERE sender_id IS NOT NULL AND recipient_id IS NOT NULL
+        ) pairs
+        WHERE id != keep_id
+        """
+    )
+    op.execute(
+        """
+        UPDATE messages m SET conversation_id = d.keep_id
+        FROM duplicate_conversations d
+        WHERE m.conversation_id = d.id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM conversations c
+        USING duplicate_conversations d
+        WHERE c.id = d.id
+        """
+    )
+
+    op.create_index(
+        "ix_conversations_participants",
+        "conversations",
+        ["least_user_id", "greatest_user_id"],
+        unique=True,
+        postgresql_where=sa.text("sender_id IS NOT NULL AND recipient_id IS NOT NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_conversations_participants", table_name="conversations")
+    op.drop_column("conversations", "greatest_user_id")
+    op.drop_column("conversations", "least_user_id")
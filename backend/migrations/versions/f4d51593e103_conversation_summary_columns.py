@@ -0,0 +1,94 @@
+"""conversation summary columns
+
+Revision ID: f4d51593e103
+Revises: ea3ba9621601
+Create Date: 2026-10-18 11:27:05.904412
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "f4d51593e103"
+down_revision = "ea3ba9621601"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "conversations", sa.Column("last_message_at", sa.DateTime(), nullable=True)
+    )
+    op.add_column(
+        "conversations",
+        sa.Column("last_message_preview", sa.String(length=100), nullable=True),
+    )
+    op.add_column(
+        "conversations",
+        sa.Column(
+            "sender_unread_count", sa.Integer(), server_default="0", nullable=False
+        ),
+    )
+    op.add_column(
+        "conversations",
+        sa.Column(
+            "recipient_unread_count", sa.Integer(), server_default="0", nullable=False
+        ),
+    )
+
+    op.execute(
+        """
+        UPDATE conversations c SET
+            last_message_at = COALESCE(
+                (SELECT m.created_at FROM messages m
+                 WHERE m.conversation_id = c.id
+                 ORDER BY m.created_at DESC, m.id DESC LIMIT 1),
+                c.created_at,
+                now() AT TIME ZONE 'utc'
+            ),
+            last_message_preview = (
+                SELECT left(m.body, 100) FROM messages m
+                WHERE m.conversation_id = c.id
+                AND m.deleted_by IS NULL
+                ORDER BY m.created_at DESC, m.id DESC LIMIT 1
+            ),
+            sender_unread_count = (
+                SELECT count(m.id) FROM messages m
+                WHERE m.conversation_id = c.id
+                AND m.read IS NULL
+                AND m.sender_id != c.sender_id
+                AND (m.deleted_by IS NULL OR m.deleted_by != c.sender_id)
+            ),
+            recipient_unread_count = (
+                SELECT count(m.id) FROM messages m
+                WHERE m.conversation_id = c.id
+                AND m.read IS NULL
+                AND m.sender_id != c.recipient_id
+                AND (m.deleted_by IS NULL OR m.deleted_by != c.recipient_id)
+            )
+        """
+    )
+    op.alter_column("conversations", "last_message_at", nullable=False)
+
+    op.create_index(
+        "ix_conversations_sender_inbox",
+        "conversations",
+        ["sender_id", "last_message_at", "id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_conversations_recipient_inbox",
+        "conversations",
+        ["recipient_id", "last_message_at", "id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_conversations_recipient_inbox", table_name="conversations")
+    op.drop_index("ix_conversations_sender_inbox", table_name="conversations")
+    op.drop_column("conversations", "recipient_unread_count")
+    op.drop_column("conversations", "sender_unread_count")
+    op.drop_column("conversations", "last_message_preview")
+    op.drop_column("conversations", "last_message_at")
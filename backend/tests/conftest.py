@@ -1,6 +1,15 @@
 import pytest
 
 from app import create_app, db
+from app.utils import get_redis
+
+
+def clear_user_caches():
+    # user ids start over with every new database
+    redis = get_redis()
+    for pattern in ("relationships:*", "search:*", "last_seen:*", "users:*"):
+        for key in redis.scan_iter(pattern):
+            redis.delete(key)
 
 
 @pytest.fixture(scope="session")
@@ -21,6 +30,7 @@ def client_database(app):
     db.app = app
 
     with app.app_context():
+        clear_user_caches()
         db.create_all()
 
     yield db
@@ -39,6 +49,7 @@ def database(app):
     db.app = app
 
     with app.app_context():
+        clear_user_caches()
         db.create_all()
 
     yield db
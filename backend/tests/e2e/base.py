@@ -0,0 +1,61 @@
+import pytest
+
+
+def make_user(username, **fields):
+    return {
+        "email": f"{username}@example.com",
+        "username": username,
+        "password": "password",
+        **fields,
+    }
+
+
+@pytest.mark.usefixtures("client", "client_database")
+class BaseTestUsers:
+    """
+    Registers the class's users and switches between them on the session's
+    client, tests log out when they are done
+    """
+
+    users = []
+
+    def register(self, client, *users):
+        """
+        Registers the users, the class's own by default, and returns their
+        ids. Logs in as each for the id, the client is left logged out.
+        """
+        ids = []
+        for user in users or self.users:
+            response = client.post("/api/users/register", json=user)
+            assert response.status_code == 201
+            ids.append(self.login(client, user)["id"])
+        self.logout(client)
+        return ids
+
+    def login(self, client, user):
+        """Logs in as a user or a username made by make_user, returns the user"""
+        if isinstance(user, str):
+            user = make_user(user)
+
+        response = client.post(
+            "/api/users/login",
+            json={"emailOrUsername": user["username"], "password": user["password"]},
+        )
+        assert response.status_code == 200
+        return response.json
+
+    def logout(self, client):
+        response = client.post("/api/users/logout")
+        assert response.status_code == 200
+
+    def add(self, client, user):
+        username = user if isinstance(user, str) else user["username"]
+        response = client.post(f"/api/relationships/add/{username}")
+        assert response.status_code == 200
+
+    def make_friends(self, client, user, other):
+        """Each adds the other, the client is left logged in as ``other``"""
+        self.login(client, user)
+        self.add(client, other)
+        self.login(client, other)
+        self.add(client, user)
@@ -0,0 +1,362 @@
+import json
+
+from app.utils import get_redis
+from websockets import EVENTS
+
+from base import BaseTestUsers, make_user
+
+
+class BaseTestConversation(BaseTestUsers):
+    users = [make_user("alice", name="Alice"), make_user("bob", name="Bob")]
+
+    def setup_friends(self, client):
+        alice, bob = self.users
+        _, bob_id = self.register(client)
+        self.make_friends(client, alice, bob)
+        self.login(client, alice)
+
+        return bob_id
+
+
+class TestClassInbox(BaseTestConversation):
+    def test_inbox_returns_latest_messages(self, client):
+        bob_id = self.setup_friends(client)
+
+        response = client.post(
+            "/api/conversations", json={"recipientId": bob_id, "messageBody": "hi"}
+        )
+        assert response.status_code == 200
+        conversation_id = response.json["id"]
+
+        for i in range(15):
+            response = client.post(
+                f"/api/conversations/{conversation_id}", json={"body": f"msg {i}"}
+            )
+            assert response.status_code == 200
+
+        response = client.get("/api/conversations")
+        assert response.status_code == 200
+        (conversation,) = response.json
+        assert conversation["id"] == conversation_id
+        assert conversation["recipientId"] == bob_id
+        assert [msg["body"] for msg in conversation["messages"]] == [
+            f"msg {i}" for i in range(5, 15)
+        ]
+        self.logout(client)
+
+    def test_inbox_includes_all_unread_messages(self, client):
+        self.login(client, self.users[1])
+
+        response = client.get("/api/conversations")
+        assert response.status_code == 200
+        (conversation,) = response.json
+        assert len(conversation["messages"]) == 16
+        assert conversation["messages"][0]["body"] == "hi"
+        self.logout(client)
+
+
+class TestClassPagination(BaseTestConversation):
+    def test_pages_with_cursor(self, client):
+        bob_id = self.setup_friends(client)
+
+        response = client.post(
+            "/api/conversations", json={"recipientId": bob_id, "messageBody": "msg 0"}
+        )
+        conversation_id = response.json["id"]
+        for i in range(1, 12):
+            response = client.post(
+                f"/api/conversations/{conversation_id}", json={"body": f"msg {i}"}
+            )
+            assert response.status_code == 200
+
+        url = f"/api/conversations/{conversation_id}"
+        response = client.get(f"{url}?limit=5")
+        assert response.status_code == 200
+        page = response.json["messages"]
+        assert [msg["body"] for msg in page] == [f"msg {i}" for i in range(7, 12)]
+
+        oldest = page[0]
+        response = client.get(
+            url,
+            query_string={
+                "limit": 5,
+                "timestamp": oldest["createdAt"],
+                "messageId": oldest["id"],
+            },
+        )
+        assert response.status_code == 200
+        page = response.json["messages"]
+        assert [msg["body"] for msg in page] == [f"msg {i}" for i in range(2, 7)]
+        self.logout(client)
+
+    def test_jumps_to_first_unread(self, client):
+        self.login(client, self.users[1])
+
+        (conversation,) = client.get("/api/conversations").json
+        url = f"/api/conversations/{conversation['id']}/unread"
+
+        response = client.get(f"{url}?limit=3")
+        assert response.status_code == 200
+        page = response.json["messages"]
+        assert [msg["body"] for msg in page] == ["msg 0", "msg 1", "msg 2"]
+
+        response = client.post(
+            "/api/conversations/messages/read",
+            json={"ids": [msg["id"] for msg in conversation["messages"][:6]]},
+        )
+        assert response.status_code == 200
+
+        response = client.get(f"{url}?limit=3")
+        page = response.json["messages"]
+        assert [msg["body"] for msg in page] == ["msg 6", "msg 7", "msg 8"]
+        self.logout(client)
+
+
+class TestClassReadMessages(BaseTestConversation):
+    def test_read_messages(self, client):
+        bob_id = self.setup_friends(client)
+
+        response = client.post(
+            "/api/conversations", json={"recipientId": bob_id, "messageBody": "msg 0"}
+        )
+        conversation_id = response.json["id"]
+        for i in range(1, 6):
+            client.post(
+                f"/api/conversations/{conversation_id}", json={"body": f"msg {i}"}
+            )
+        self.login(client, self.users[1])
+
+        (conversation,) = client.get("/api/conversations").json
+        ids = [msg["id"] for msg in conversation["messages"]]
+
+        response = client.post(
+            "/api/conversations/messages/read", json={"ids": ids[:2]}
+        )
+        assert response.status_code == 200
+
+        response = client.post(
+            "/api/conversations/messages/read", json={"ids": ids[:3]}
+        )
+        assert response.status_code == 400
+        assert (
+            response.json["message"] == f"Messages {','.join(ids[:2])} are already read"
+        )
+
+        unknown = "6b9f3a2e-53c4-4a5e-9d4c-0c1b3f8f2a11"
+        response = client.post(
+            "/api/conversations/messages/read", json={"ids": [ids[2], unknown]}
+        )
+        assert response.status_code == 400
+        assert response.json["message"] == f"Messages {unknown} are not exist"
+
+        response = client.post(
+            "/api/conversations/messages/read", json={"upTo": ids[4]}
+        )
+        assert response.status_code == 200
+
+        response = client.get(f"/api/conversations/{conversation_id}")
+        assert [msg["id"] for msg in response.json["messages"]] == ids
+        assert [msg["read"] for msg in response.json["messages"]] == [
+            True,
+            True,
+            True,
+            True,
+            True,
+            None,
+        ]
+
+        response = client.post(
+            "/api/conversations/messages/read", json={"ids": ids, "upTo": ids[5]}
+        )
+        assert response.status_code == 422
+        self.logout(client)
+
+
+class TestClassDeleteMessages(BaseTestConversation):
+    def test_delete_messages(self, client):
+        bob_id = self.setup_friends(client)
+
+        response = client.post(
+            "/api/conversations", json={"recipientId": bob_id, "messageBody": "msg 0"}
+        )
+        conversation_id = response.json["id"]
+        for i in range(1, 4):
+            client.post(
+                f"/api/conversations/{conversation_id}", json={"body": f"msg {i}"}
+            )
+        url = f"/api/conversations/{conversation_id}"
+        ids = [msg["id"] for msg in client.get(url).json["messages"]]
+
+        response = client.delete(
+            "/api/conversations/messages/delete", json={"ids": ids[:2]}
+        )
+        assert response.status_code == 200
+        assert [msg["id"] for msg in client.get(url).json["messages"]] == ids[2:]
+
+        response = client.delete(
+            "/api/conversations/messages/delete", json={"ids": ids[1:3]}
+        )
+        assert response.status_code == 400
+        assert response.json["message"] == f"Messages {ids[1]} are already deleted"
+
+        self.login(client, self.users[1])
+        response = client.delete(
+            "/api/conversations/messages/delete", json={"ids": ids[:3]}
+        )
+        assert response.status_code == 200
+        assert [msg["id"] for msg in client.get(url).json["messages"]] == ids[3:]
+
+        self.login(client, self.users[0])
+        assert [msg["id"] for msg in client.get(url).json["messages"]] == ids[2:]
+        self.logout(client)
+
+    def test_cannot_delete_messages_of_other_conversations(self, client):
+        self.login(client, self.users[0])
+        (conversation,) = client.get("/api/conversations").json
+        message_id = conversation["messages"][-1]["id"]
+        self.logout(client)
+
+        stranger = make_user("eve")
+        self.register(client, stranger)
+        self.login(client, stranger)
+
+        response = client.delete(
+            "/api/conversations/messages/delete", json={"ids": [message_id]}
+        )
+        assert response.status_code == 400
+        assert "permission" in response.json["message"]
+        self.logout(client)
+
+
+class TestClassCreateConversation(BaseTestConversation):
+    def test_cannot_create_conversation_twice(self, client):
+        bob_id = self.setup_friends(client)
+
+        response = client.post(
+            "/api/conversations", json={"recipientId": bob_id, "messageBody": "hi"}
+        )
+        assert response.status_code == 200
+        alice_id = response.json["senderId"]
+
+        response = client.post(
+            "/api/conversations", json={"recipientId": bob_id, "messageBody": "hi"}
+        )
+        assert response.status_code == 400
+
+        self.login(client, self.users[1])
+        response = client.post(
+            "/api/conversations", json={"recipientId": alice_id, "messageBody": "hi"}
+        )
+        assert response.status_code == 400
+        assert response.json["message"] == "Conversation already exists"
+        self.logout(client)
+
+
+class TestClassConversationSummary(BaseTestConversation):
+    def test_summary_follows_send_read_and_delete(self, client):
+        bob_id = self.setup_friends(client)
+
+        response = client.post(
+            "/api/conversations", json={"recipientId": bob_id, "messageBody": "msg 0"}
+        )
+        conversation_id = response.json["id"]
+        for i in range(1, 4):
+            client.post(
+                f"/api/conversations/{conversation_id}", json={"body": f"msg {i}"}
+            )
+
+        (conversation,) = client.get("/api/conversations").json
+        assert conversation["lastMessagePreview"] == "msg 3"
+        assert conversation["unreadCount"] == 0
+        ids = [msg["id"] for msg in conversation["messages"]]
+
+        self.login(client, self.users[1])
+        (conversation,) = client.get("/api/conversations").json
+        assert conversation["unreadCount"] == 4
+
+        client.post("/api/conversations/messages/read", json={"ids": ids[:2]})
+        (conversation,) = client.get("/api/conversations").json
+        assert conversation["unreadCount"] == 2
+
+        client.delete("/api/conversations/messages/delete", json={"ids": ids[3:]})
+        (conversation,) = client.get("/api/conversations").json
+        assert conversation["unreadCount"] == 1
+        # the deleted message is no longer previewed
+        assert conversation["lastMessagePreview"] == "msg 2"
+
+        client.post("/api/conversations/messages/read", json={"upTo": ids[3]})
+        (conversation,) = client.get("/api/conversations").json
+        assert conversation["unreadCount"] == 0
+        self.logout(client)
+
+    def test_inbox_is_ordered_and_paged_by_recency(self, client):
+        alice, bob = self.users
+        carol = make_user("carol")
+        (carol_id,) = self.register(client, carol)
+        self.make_friends(client, carol, alice)
+
+        client.post(
+            "/api/conversations", json={"recipientId": carol_id, "messageBody": "hey"}
+        )
+
+        first, second = client.get("/api/conversations").json
+        assert first["recipientId"] == carol_id
+        # bob deleted msg 3, which the shared preview skips
+        assert second["lastMessagePreview"] == "msg 2"
+
+        (page,) = client.get("/api/conversations?limit=1").json
+        assert page["id"] == first["id"]
+        (page,) = client.get(
+            "/api/conversations",
+            query_string={
+                "limit": 1,
+                "before": first["lastMessageAt"],
+                "beforeId": first["id"],
+            },
+        ).json
+        assert page["id"] == second["id"]
+        self.logout(client)
+
+
+class TestClassConversationEvents(BaseTestConversation):
+    def last_event(self, user_id):
+        [(_, fields)] = get_redis().xrevrange(EVENTS % user_id, count=1)
+        return json.loads(fields[b"data"])
+
+    def test_events_carry_the_changes(self, client):
+        bob_id = self.setup_friends(client)
+        get_redis().delete(EVENTS % bob_id)
+
+        response = client.post(
+            "/api/conversations", json={"recipientId": bob_id, "messageBody": "hi"}
+        )
+        assert response.status_code == 200
+        conversation_id = response.json["id"]
+
+        event = self.last_event(bob_id)
+        assert event["kind"] == "NEW"
+        assert event["conversation"]["id"] == conversation_id
+        assert event["conversation"]["unreadCount"] == 1
+        assert [msg["body"] for msg in event["conversation"]["messages"]] == ["hi"]
+
+        response = client.post(
+            f"/api/conversations/{conversation_id}", json={"body": "there"}
+        )
+        assert response.status_code == 200
+
+        event = self.last_event(bob_id)
+        assert event["kind"] == "UPDATE"
+        assert event["message"] == response.json
+
+        alice, _ = self.users
+        self.login(client, self.users[1])
+        assert (
+            client.delete(f"/api/relationships/delete/{alice['username']}").status_code
+            == 200
+        )
+        alice_id = self.login(client, alice)["id"]
+        event = self.last_event(alice_id)
+        assert event["kind"] == "DELETE"
+        assert event["user"]["username"] == "bob"
+
+        self.logout(client)
@@ -0,0 +1,214 @@
+import random
+
+from sqlalchemy import event
+
+from app import db, tasks
+from app.models.relationship import Relationship, RelationshipType
+from app.utils import relationship_cache
+
+from base import BaseTestUsers, make_user
+
+
+class TestClassFriends(BaseTestUsers):
+    users = [make_user(name) for name in ("alice", "bob", "carol", "dave", "eve")]
+
+    def get_friends(self, client):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            response = client.get("/api/relationships/friends")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+
+        assert response.status_code == 200
+        return response.json, len(statements)
+
+    def usernames(self, users):
+        return sorted(user["username"] for user in users)
+
+    def test_friends_requests_and_others(self, client):
+        usernames = [user["username"] for user in self.users]
+        ids = dict(zip(usernames, self.register(client)))
+
+        self.make_friends(client, "bob", "alice")
+        self.login(client, "carol")
+        self.add(client, "alice")
+        self.login(client, "alice")
+        self.add(client, "dave")
+
+        data, queries = self.get_friends(client)
+        assert self.usernames(data["friends"]) == ["bob"]
+        assert "lastSeen" in data["friends"][0]
+        assert self.usernames(data["friendRequests"]) == ["carol"]
+        assert data["others"] == []
+
+        # eve stays in alice's list through their conversation after unfriending
+        self.make_friends(client, "eve", "alice")
+        response = client.post(
+            "/api/conversations", json={"recipientId": ids["eve"], "messageBody": "hi"}
+        )
+        assert response.status_code == 200
+        self.login(client, "eve")
+        response = client.delete("/api/relationships/delete/alice")
+        assert response.status_code == 200
+        self.login(client, "dave")
+        self.add(client, "alice")
+        self.login(client, "alice")
+
+        data, more_queries = self.get_friends(client)
+        assert self.usernames(data["friends"]) == ["bob", "dave"]
+        assert self.usernames(data["friendRequests"]) == ["carol"]
+        assert self.usernames(data["others"]) == ["eve"]
+        assert "lastSeen" not in data["others"][0]
+        assert more_queries == queries
+
+        self.logout(client)
+
+
+class TestClassRelationshipCache(BaseTestUsers):
+    usernames = ["alice", "bob", "carol", "dave", "eve"]
+    users = [make_user(name) for name in usernames]
+
+    def assert_cache_matches_database(self, user_ids):
+        edges = {
+            (r.requester_id, r.addressee_id, r.relationship_type)
+            for r in Relationship.query
+        }
+        for user_id in user_ids:
+            for relationship_type in RelationshipType:
+                out_ids = {
+                    addressee_id
+                    for requester_id, addressee_id, edge_type in edges
+                    if requester_id == user_id and edge_type is relationship_type
+                }
+                in_ids = {
+                    requester_id
+                    for requester_id, addressee_id, edge_type in edges
+                    if addressee_id == user_id and edge_type is relationship_type
+                }
+                assert relationship_cache.get_edges(user_id, relationship_type) == (
+                    out_ids,
+                    in_ids,
+                )
+
+    def test_cache_follows_random_operations(self, client):
+        user_ids = dict(zip(self.usernames, self.register(client)))
+
+        operations = [
+            ("POST", "/api/relationships/add/%s"),
+            ("DELETE", "/api/relationships/delete/%s"),
+            ("POST", "/api/relationships/block/%s"),
+            ("POST", "/api/relationships/unblock/%s"),
+            ("GET", "/api/relationships/friends"),
+        ]
+        rng = random.Random(14)
+        for _ in range(100):
+            username, other = rng.sample(self.usernames, 2)
+            method, url = rng.choice(operations)
+            self.login(client, username)
+            response = client.open(url.replace("%s", other), method=method)
+            # invalid operations, like adding twice, are refused but change nothing
+            assert response.status_code in (200, 400, 404)
+
+            if rng.random() < 0.1:
+                self.assert_cache_matches_database(user_ids.values())
+
+        self.assert_cache_matches_database(user_ids.values())
+
+        self.login(client, "eve")
+        response = client.delete("/api/users/delete", json={"password": "password"})
+        assert response.status_code == 200
+        self.assert_cache_matches_database(user_ids.values())
+
+    def test_load_retries_after_a_concurrent_write(self, client):
+        usernames = ("frank", "grace", "heidi")
+        user_ids = dict(
+            zip(usernames, self.register(client, *map(make_user, usernames)))
+        )
+        for username in ("grace", "heidi"):
+            self.login(client, username)
+            self.add(client, "frank")
+        self.logout(client)
+        frank_id, grace_id = user_ids["frank"], user_ids["grace"]
+        relationship_cache.forget_user(frank_id, [])
+
+        # grace's edge is written through while frank's rows are being read
+        concurrent_writes = [
+            lambda: relationship_cache.refresh_pair(frank_id, grace_id)
+        ]
+
+        def write_concurrently(*args):
+            if concurrent_writes:
+                concurrent_writes.pop()()
+
+        event.listen(db.engine, "before_cursor_execute", write_concurrently)
+        try:
+            _, added_by_ids = relationship_cache.get_edges(
+                frank_id, RelationshipType.FRIEND
+            )
+        finally:
+            event.remove(db.engine, "before_cursor_execute", write_concurrently)
+
+        assert not concurrent_writes
+        # not only the edge written through
+        assert added_by_ids == {grace_id, user_ids["heidi"]}
+
+
+class TestClassSuggestions(BaseTestUsers):
+    users = [make_user(name) for name in ("alice", "bob", "carol", "dave", "eve")]
+
+    def request(self, client, username, method, url):
+        self.login(client, username)
+        assert client.open(url, method=method).status_code == 200
+        # run the refreshes the request queued, as the worker would
+        while self.queued:
+            tasks.refresh_friend_suggestions(*self.queued.pop(0))
+
+    def befriend(self, client, username, other):
+        self.request(client, username, "POST", f"/api/relationships/add/{other}")
+        self.request(client, other, "POST", f"/api/relationships/add/{username}")
+
+    def suggestions(self, client, username):
+        self.login(client, username)
+        response = client.get("/api/relationships/suggestions")
+        assert response.status_code == 200
+        return [(user["username"], user["mutualFriends"]) for user in response.json]
+
+    def test_suggestions_follow_relationship_changes(self, client, monkeypatch):
+        self.queued = []
+        monkeypatch.setattr(
+            tasks.refresh_friend_suggestions,
+            "delay",
+            lambda *args: self.queued.append(args),
+        )
+        self.register(client)
+
+        for username, other in [
+            ("alice", "bob"),
+            ("alice", "carol"),
+            ("bob", "dave"),
+            ("carol", "dave"),
+            ("bob", "eve"),
+        ]:
+            self.befriend(client, username, other)
+
+        assert self.suggestions(client, "alice") == [("dave", 2), ("eve", 1)]
+        assert self.suggestions(client, "eve") == [("alice", 1), ("dave", 1)]
+
+        self.request(client, "eve", "POST", "/api/relationships/block/alice")
+        assert self.suggestions(client, "alice") == [("dave", 2)]
+        assert self.suggestions(client, "eve") == [("dave", 1)]
+
+        self.request(client, "carol", "DELETE", "/api/relationships/delete/dave")
+        assert self.suggestions(client, "alice") == [("dave", 1)]
+
+        # pending requests are no longer suggested, even before the refresh
+        self.login(client, "alice")
+        self.add(client, "dave")
+        assert self.suggestions(client, "alice") == []
+
+        self.logout(client)
@@ -0,0 +1,224 @@
+import os
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app import db
+from app.models.user import User
+
+from base import BaseTestUsers, make_user
+
+
+class BaseTestSearch(BaseTestUsers):
+    users = [
+        make_user("alice", name="Alice Smith"),
+        make_user("bob", name="Bob Jones"),
+        make_user("eve", name="Eve Smith"),
+    ]
+
+
+class TestClassSearchMessages(BaseTestSearch):
+    def test_search_messages(self, client):
+        alice, bob, eve = self.users
+        _, bob_id, eve_id = self.register(client)
+        self.make_friends(client, alice, bob)
+        self.make_friends(client, alice, eve)
+
+        self.login(client, alice)
+        for recipient_id, body in (
+            (bob_id, "Lunch tomorrow?"),
+            (eve_id, "Lunch at noon"),
+        ):
+            response = client.post(
+                "/api/conversations",
+                json={"recipientId": recipient_id, "messageBody": body},
+            )
+            assert response.status_code == 200
+
+        self.login(client, bob)
+        response = client.get("/api/search", query_string={"term": "lunch"})
+        assert response.status_code == 200
+        (result,) = response.json["messages"]["results"]
+        assert result["body"] == "Lunch tomorrow?"
+        assert result["highlight"].startswith("<mark>Lunch</mark>")
+
+        self.login(client, alice)
+        response = client.get(
+            "/api/search", query_string={"term": "lunch", "limit": 1, "page": 2}
+        )
+        assert len(response.json["messages"]["results"]) == 1
+        self.logout(client)
+
+
+class TestClassSearchHighlights(BaseTestSearch):
+    def test_highlights_escape_the_message_body(self, client):
+        alice, bob, _ = self.users
+        _, bob_id, _ = self.register(client)
+        self.make_friends(client, alice, bob)
+
+        self.login(client, alice)
+        body = "<img src=x onerror=\"alert('picnic')\"> picnic & <b>games</b>"
+        response = client.post(
+            "/api/conversations",
+            json={"recipientId": bob_id, "messageBody": body},
+        )
+        assert response.status_code == 200
+
+        self.login(client, bob)
+
+        response = client.get("/api/search", query_string={"term": "picnic"})
+        (result,) = response.json["messages"]["results"]
+        assert result["body"] == body
+        # the marks are the only markup left
+        unmarked = result["highlight"].replace("<mark>", "").replace("</mark>", "")
+        assert "<" not in unmarked and ">" not in unmarked
+        assert "alert(&#x27;<mark>picnic</mark>&#x27;)&quot;&gt;" in result["highlight"]
+        assert "<mark>picnic</mark> &amp; &lt;b&gt;games" in result["highlight"]
+        self.logout(client)
+
+
+class TestClassSearchUser(BaseTestSearch):
+    def relationship_state(self, client, username):
+        response = client.get(f"/api/search/user/{username}")
+        assert response.status_code == 200
+        return response.json["relationshipState"]
+
+    def test_relationship_states_and_friend_count(self, client):
+        self.register(client)
+        alice, bob, eve = self.users
+
+        self.login(client, alice)
+        assert self.relationship_state(client, "bob") is None
+        self.add(client, "bob")
+        assert self.relationship_state(client, "bob") == "REQUESTED"
+        self.login(client, bob)
+        assert self.relationship_state(client, "alice") == "REQUESTEE"
+
+        self.make_friends(client, bob, eve)
+        self.login(client, bob)
+        self.add(client, "alice")
+        response = client.get("/api/search/user/alice")
+        assert response.json["relationshipState"] == "ACCEPTED"
+        assert response.json["numberOfFriends"] == 1
+        response = client.get("/api/search/user/eve")
+        assert response.json["numberOfFriends"] == 1
+        self.login(client, alice)
+        assert client.get("/api/search/user/bob").json["numberOfFriends"] == 2
+
+        assert client.post("/api/relationships/block/eve").status_code == 200
+        assert self.relationship_state(client, "eve") == "BLOCKED"
+        self.login(client, eve)
+        response = client.get("/api/search/user/alice")
+        assert response.status_code == 400
+        assert response.json["message"] == "Unable to view this user"
+
+        self.logout(client)
+
+
+class TestClassSearchUsers(BaseTestSearch):
+    def search_users(self, client, term, **params):
+        response = client.get("/api/search", query_string={"term": term, **params})
+        assert response.status_code == 200
+        return [user["username"] for user in response.json["users"]["results"]]
+
+    def test_search_users(self, client):
+        self.register(client)
+        bob = self.users[1]
+        self.login(client, bob)
+
+        assert self.search_users(client, "smi") == ["alice", "eve"]
+        # every word has to match
+        assert self.search_users(client, "Smith al") == ["alice"]
+        assert self.search_users(client, "smith jones") == []
+        assert self.search_users(client, "sm", limit=1, page=2) == ["eve"]
+        # operators are not passed through to the query
+        assert self.search_users(client, "smith | ! (:*") == ["alice", "eve"]
+        assert self.search_users(client, "&") == []
+
+        # exclusions come before the limit, pages are never short
+        alice, _, eve = self.users
+        self.login(client, alice)
+        assert self.search_users(client, "smi", limit=1) == ["eve"]
+        self.login(client, eve)
+        assert client.post("/api/relationships/block/bob").status_code == 200
+        self.login(client, bob)
+        assert self.search_users(client, "smi", limit=1) == ["alice"]
+        assert self.search_users(client, "smi", limit=1, page=2) == []
+
+        self.logout(client)
+
+
+class TestClassSimilarUsers(BaseTestSearch):
+    @pytest.fixture()
+    def trigram_fallback(self, app):
+        try:
+            db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            db.session.commit()
+        except DBAPIError:
+            db.session.rollback()
+            # CI runs against the postgres image of the compose file, which
+            # ships pg_trgm, the test must never be skipped there
+            if os.environ.get("CI"):
+                raise
+            pytest.skip("pg_trgm is not available")
+
+        app.config["SEARCH_TRIGRAM_FALLBACK"] = True
+        yield
+        app.config["SEARCH_TRIGRAM_FALLBACK"] = False
+
+    def test_typos_fall_back_to_similar_users(self, client, trigram_fallback):
+        self.register(client)
+        self.login(client, self.users[1])
+
+        # no word starts with it, but most of its trigrams are in alice's
+        response = client.get("/api/search", query_string={"term": "alicee"})
+        assert response.status_code == 200
+        usernames = [user["username"] for user in response.json["users"]["results"]]
+        assert usernames == ["alice"]
+
+        self.logout(client)
+
+
+class TestClassSuggest(BaseTestSearch):
+    def suggest(self, client, term, **params):
+        response = client.get(
+            "/api/search/suggest", query_string={"term": term, **params}
+        )
+        assert response.status_code == 200
+        return [user["username"] for user in response.json]
+
+    def test_suggestions_follow_user_changes(self, client):
+        self.register(client)
+        alice, bob, eve = self.users
+
+        self.login(client, bob)
+        assert self.suggest(client, "SM") == ["alice", "eve"]
+        assert self.suggest(client, "alice s") == ["alice"]
+        assert self.suggest(client, "e", limit=1) == ["eve"]
+        # the viewer is never suggested
+        assert self.suggest(client, "bob") == []
+
+        self.login(client, eve)
+        assert client.post("/api/relationships/block/bob").status_code == 200
+        self.login(client, bob)
+        assert self.suggest(client, "sm") == ["alice"]
+
+        self.login(client, alice)
+        token = (
+            User.query.filter_by(username="alice").first().generate_confirmation_token()
+        )
+        assert client.post(f"/api/users/confirm/{token}").status_code == 200
+        response = client.patch("/api/users/update", json={"name": "Alice Brown"})
+        assert response.status_code == 200
+        self.login(client, bob)
+        assert self.suggest(client, "sm") == []
+        assert self.suggest(client, "bro") == ["alice"]
+
+        self.login(client, alice)
+        response = client.delete("/api/users/delete", json={"password": "password"})
+        assert response.status_code == 200
+        self.login(client, bob)
+        assert self.suggest(client, "bro") == []
+
+        self.logout(client)
@@ -1,8 +1,11 @@
 import pytest
 import logging
+import time
+from datetime import datetime, timedelta
 from faker import Faker
 
 from app.models.user import User
+from app.utils import get_redis, last_seen, user_cache
 
 
 @pytest.mark.usefixtures("client", "client_database")
@@ -222,6 +225,91 @@ class TestClassChangeEmail(BaseTestUser):
         assert response.status_code == 200
 
 
+class TestClassLastSeen(BaseTestUser):
+    def get_last_seen(self, client_database):
+        return (
+            client_database.session.query(User.last_seen)
+            .filter_by(username=self.user["username"])
+            .scalar()
+        )
+
+    def test_requests_do_not_write_last_seen(self, client, client_database):
+        self.setup_basic_user(client)
+        before = self.get_last_seen(client_database)
+
+        response = client.get("/api/users/whoami")
+        assert response.status_code == 200
+        assert self.get_last_seen(client_database) == before
+        assert get_redis().zscore(last_seen.PENDING, response.json["id"])
+
+    def test_flush_writes_last_seen(self, client, client_database):
+        before = self.get_last_seen(client_database)
+
+        assert last_seen.flush() == 1
+        client_database.session.commit()
+        assert self.get_last_seen(client_database) > before
+        assert last_seen.flush() == 0
+        self.logout_user(client)
+
+    def test_last_seen_is_utc_whatever_the_host_timezone(
+        self, client_database, monkeypatch
+    ):
+        user_id = User.query.filter_by(username=self.user["username"]).first().id
+        monkeypatch.setenv("TZ", "Europe/Berlin")
+        time.tzset()
+        try:
+            last_seen.touch(user_id)
+            assert last_seen.flush() == 1
+        finally:
+            monkeypatch.undo()
+            time.tzset()
+
+        client_database.session.commit()
+        drift = datetime.utcnow() - self.get_last_seen(client_database)
+        assert abs(drift) < timedelta(minutes=1)
+
+
+class TestClassUserCache(BaseTestUser):
+    def test_requests_use_the_cached_identity(self, client, client_database):
+        self.setup_basic_user(client)
+        user_id = client.get("/api/users/whoami").json["id"]
+        assert get_redis().exists(user_cache.IDENTITY % user_id)
+
+        # a change committed without invalidating the identity is not seen
+        User.query.filter_by(id=user_id).update({"name": "Johnny Stale"})
+        client_database.session.commit()
+        assert client.get("/api/users/whoami").json["name"] == "Johnny Cash"
+
+        user_cache.invalidate(user_id)
+        assert client.get("/api/users/whoami").json["name"] == "Johnny Stale"
+
+    def test_flushing_last_seen_keeps_the_cached_identity(
+        self, client, client_database
+    ):
+        user_id = client.get("/api/users/whoami").json["id"]
+        before = client.get("/api/users/whoami").json["lastSeen"]
+        assert user_cache.get(user_id)[1] is not None
+
+        time.sleep(0.01)
+        last_seen.touch(user_id)
+        assert last_seen.flush() == 1
+        assert user_cache.get(user_id)[1] is not None
+        # read from the row, not the cache
+        assert client.get("/api/users/whoami").json["lastSeen"] > before
+
+    def test_changes_invalidate_the_cached_identity(self, client, client_database):
+        user = User.query.filter_by(username=self.user["username"]).first()
+        token = user.generate_confirmation_token()
+
+        response = client.post(f"/api/users/confirm/{token}")
+        assert response.status_code == 200
+        # refused if the cached identity were still unconfirmed
+        response = client.patch("/api/users/update", json={"name": "Johnny B"})
+        assert response.status_code == 200
+        assert client.get("/api/users/whoami").json["name"] == "Johnny B"
+        self.logout_user(client)
+
+
 @pytest.mark.usefixtures("client", "client_database")
 class TestClassAdvanced:
     users = [
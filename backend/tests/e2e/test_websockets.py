@@ -0,0 +1,337 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from http.cookiejar import CookieJar
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from redis.exceptions import RedisError
+
+from app import socketio
+from app.api import conversations as conversations_api
+from app.models.conversation import Conversation
+from app.utils import get_redis
+import websockets
+from websockets import ACTIVE_CLIENTS, EVENTS, HEAD, get_client_sids
+
+from base import BaseTestUsers, make_user
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+WORKER = """
+import sys
+import eventlet
+
+eventlet.monkey_patch()
+
+from app import create_app, socketio
+from app.models import *
+from app.utils import get_redis_uri
+from config import config
+from websockets import *
+
+config["TESTING"].SOCKETIO_MESSAGE_QUEUE = get_redis_uri()
+app = create_app("TESTING")
+socketio.run(app, port=int(sys.argv[1]), log_output=False)
+"""
+
+TASK = """
+import sys
+
+from app import create_celery_app
+from app.utils import get_redis_uri
+from config import config
+from websockets import send_event_to_client
+
+config["TESTING"].SOCKETIO_MESSAGE_QUEUE = get_redis_uri()
+app = create_celery_app("TESTING")
+with app.app_context():
+    send_event_to_client({"name": "task"}, int(sys.argv[1]))
+"""
+
+
+class Worker:
+    """A separate web server process, like one flask replica behind nginx"""
+
+    def __init__(self, port):
+        self.url = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", WORKER, str(port)], cwd=BACKEND_DIR
+        )
+
+        deadline = time.time() + 30
+        while True:
+            try:
+                build_opener().open(f"{self.url}/api/health", timeout=1)
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class Client:
+    """A device talking to one worker over plain HTTP and socket.io polling"""
+
+    def __init__(self, worker):
+        self.url = worker.url
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+        self.sid = None
+        self.socket_sid = None
+
+    def request(self, method, path, payload=None):
+        request = Request(f"{self.url}{path}", method=method)
+        data = None
+        if payload is not None:
+            request.add_header("Content-Type", "application/json")
+            data = json.dumps(payload).encode("utf-8")
+        with self.opener.open(request, data, timeout=10) as response:
+            return json.loads(response.read())
+
+    def login(self, user):
+        return self.request(
+            "POST",
+            "/api/users/login",
+            {"emailOrUsername": user["username"], "password": user["password"]},
+        )
+
+    def polling(self, method="GET", data=None):
+        url = f"{self.url}/socket.io/?EIO=4&transport=polling"
+        if self.sid:
+            url += f"&sid={self.sid}"
+        with self.opener.open(Request(url, method=method), data, timeout=30) as res:
+            return res.read().decode("utf-8").split("\x1e")
+
+    def poll(self):
+        for packet in self.polling():
+            if packet.startswith("40"):
+                self.socket_sid = json.loads(packet[2:])["sid"]
+            elif packet.startswith("42"):
+                self.events.append(json.loads(packet[2:]))
+            elif packet == "2":
+                self.polling("POST", b"3")
+
+    def next_event(self, name="message", timeout=10):
+        deadline = time.time() + timeout
+        while True:
+            for event in self.events:
+                if event[0] == name:
+                    self.events.remove(event)
+                    return event[1]
+            assert time.time() < deadline, f"No {name} event received"
+            self.poll()
+
+    def connect_socket(self, auth=None):
+        self.sid, self.socket_sid, self.events = None, None, []
+        (handshake,) = self.polling()
+        self.sid = json.loads(handshake[1:])["sid"]
+        self.polling("POST", b"40" + (json.dumps(auth).encode() if auth else b""))
+        return self.next_event("sequence")["seq"]
+
+    def disconnect_socket(self):
+        self.polling("POST", b"41")
+
+
+class TestClassClusterDelivery(BaseTestUsers):
+    users = [make_user("alice"), make_user("bob")]
+
+    def test_events_reach_every_device_and_replay_on_reconnect(self, client):
+        self.register(client)
+
+        worker_a, worker_b = Worker(5101), Worker(5102)
+        try:
+            alice, bob = self.users
+            alice_laptop = Client(worker_a)
+            alice_laptop.login(alice)
+
+            # bob is connected from two devices on two different workers
+            bob_phone, bob_laptop = Client(worker_a), Client(worker_b)
+            bob_id = bob_phone.login(bob)["id"]
+            bob_laptop.login(bob)
+            get_redis().delete(ACTIVE_CLIENTS % bob_id, EVENTS % bob_id, HEAD % bob_id)
+            # left behind by a worker killed before its client disconnected
+            get_redis().zadd(ACTIVE_CLIENTS % bob_id, {"killed": time.time() - 600})
+            assert get_client_sids(bob_id) == set()
+            # nothing was missed, so a quiet user is not asked to resync
+            assert bob_phone.connect_socket({"lastSeq": "0-0"}) == "0-0"
+            assert bob_phone.events == []
+            bob_laptop.connect_socket()
+            assert get_client_sids(bob_id) == {
+                bob_phone.socket_sid,
+                bob_laptop.socket_sid,
+            }
+            assert get_redis().zscore(ACTIVE_CLIENTS % bob_id, "killed") is None
+
+            alice_laptop.request("POST", f"/api/relationships/add/{bob['username']}")
+            for device in (bob_phone, bob_laptop):
+                event = device.next_event()
+                assert event["data"]["name"] == "relationship"
+                assert event["data"]["state"] == "REQUESTEE"
+                assert event["data"]["user"]["username"] == alice["username"]
+            last_seq = event["seq"]
+
+            bob_phone.disconnect_socket()
+            deadline = time.time() + 10
+            while get_client_sids(bob_id) != {bob_laptop.socket_sid}:
+                assert time.time() < deadline
+                time.sleep(0.1)
+
+            # celery tasks reach clients through the same queue
+            subprocess.run(
+                [sys.executable, "-c", TASK, str(bob_id)], cwd=BACKEND_DIR, check=True
+            )
+            assert bob_laptop.next_event()["data"] == {"name": "task"}
+            alice_laptop.request(
+                "DELETE", f"/api/relationships/delete/{bob['username']}"
+            )
+            assert bob_laptop.next_event()["data"]["kind"] == "DELETE"
+
+            # the phone only gets what it missed while it was offline
+            head = bob_phone.connect_socket({"lastSeq": last_seq})
+            missed = [bob_phone.events.pop(0)[1] for _ in range(2)]
+            assert [event["data"]["name"] for event in missed] == [
+                "task",
+                "relationship",
+            ]
+            assert missed[-1]["seq"] == head
+            assert bob_phone.events == []
+
+            # the head outlives the expired stream
+            get_redis().delete(EVENTS % bob_id)
+            assert bob_phone.connect_socket({"lastSeq": head}) == head
+            assert bob_phone.events == []
+
+            bob_phone.connect_socket({"lastSeq": "0-1"})
+            assert bob_phone.next_event()["data"] == {"name": "resync"}
+        finally:
+            worker_a.stop()
+            worker_b.stop()
+
+
+class TestClassSendMessage(BaseTestUsers):
+    users = [make_user("alice"), make_user("bob")]
+
+    def test_send_message_is_acknowledged(self, app, client, monkeypatch):
+        alice, bob = self.users
+        _, bob_id = self.register(client)
+        self.make_friends(client, alice, bob)
+        self.login(client, alice)
+        response = client.post(
+            "/api/conversations", json={"recipientId": bob_id, "messageBody": "hi"}
+        )
+        conversation_id = response.json["id"]
+
+        socket = socketio.test_client(app, flask_test_client=client)
+        assert socket.is_connected()
+
+        ack = socket.emit(
+            "send_message",
+            {"conversationId": conversation_id, "body": "over the socket"},
+            callback=True,
+        )
+        assert ack["status"] == 200
+        assert ack["message"]["body"] == "over the socket"
+        assert ack["message"]["id"] and ack["message"]["createdAt"]
+
+        [(_, fields)] = get_redis().xrevrange(EVENTS % bob_id, count=1)
+        assert json.loads(fields[b"data"])["message"] == ack["message"]
+
+        response = client.get(f"/api/conversations/{conversation_id}")
+        assert response.json["messages"][-1] == ack["message"]
+
+        # a send retried after its ack was lost is stored once
+        message_id = str(uuid.uuid4())
+        sent = {"conversationId": conversation_id, "id": message_id, "body": "once"}
+        first = socket.emit("send_message", sent, callback=True)
+        assert first["status"] == 200 and first["message"]["id"] == message_id
+        assert socket.emit("send_message", sent, callback=True) == first
+        response = client.post(
+            f"/api/conversations/{conversation_id}",
+            json={"id": message_id, "body": "once"},
+        )
+        assert response.json == first["message"]
+        response = client.get(f"/api/conversations/{conversation_id}")
+        messages = [message["id"] for message in response.json["messages"]]
+        assert messages.count(message_id) == 1
+
+        # a retry racing the first send finds it stored once it commits
+        checks = []
+
+        def stored_later(message_id, conversation):
+            checks.append(message_id)
+            if len(checks) == 1:
+                return None
+            return sent_message(message_id, conversation)
+
+        with monkeypatch.context() as patch:
+            sent_message = conversations_api._sent_message
+            patch.setattr(conversations_api, "_sent_message", stored_later)
+            assert socket.emit("send_message", sent, callback=True) == first
+        assert len(checks) == 2
+
+        # nor taken over by the other participant
+        self.login(client, bob)
+        response = client.post(
+            f"/api/conversations/{conversation_id}",
+            json={"id": message_id, "body": "mine"},
+        )
+        assert response.status_code == 409
+        self.login(client, alice)
+
+        ack = socket.emit(
+            "send_message",
+            {"conversationId": conversation_id, "body": 1},
+            callback=True,
+        )
+        assert ack["status"] == 422
+
+        ack = socket.emit(
+            "send_message", {"conversationId": "nope", "body": "hi"}, callback=True
+        )
+        assert ack == {"status": 400, "error": "Invalid conversation id"}
+
+        def fail(*args):
+            raise RuntimeError("database is gone")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(Conversation, "record_message", fail)
+            ack = socket.emit(
+                "send_message",
+                {"conversationId": conversation_id, "body": "lost"},
+                callback=True,
+            )
+        assert ack == {"status": 500, "error": "Internal Server Error"}
+
+        # the failed send was rolled back
+        ack = socket.emit(
+            "send_message",
+            {"conversationId": conversation_id, "body": "again"},
+            callback=True,
+        )
+        assert ack["status"] == 200
+
+        # the message is stored before it is delivered, a delivery that
+        # fails must not turn it into an error the client would retry
+        class BrokenRedis:
+            def register_script(self, script):
+                raise RedisError("connection lost")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(websockets, "get_redis", BrokenRedis)
+            ack = socket.emit(
+                "send_message",
+                {"conversationId": conversation_id, "body": "undelivered"},
+                callback=True,
+            )
+        assert ack["status"] == 200
+        response = client.get(f"/api/conversations/{conversation_id}")
+        assert response.json["messages"][-1] == ack["message"]
+
+        socket.disconnect()
+        self.logout(client)
@@ -0,0 +1,31 @@
+from app import utils
+from app.utils import run_blocking
+
+
+def test_run_blocking_returns_the_result():
+    assert run_blocking(sum, [1, 2, 3]) == 6
+
+
+def test_run_blocking_uses_the_thread_pool_when_patched(monkeypatch):
+    # the latency it buys is measured by benchmarks/hashing_latency.py
+    calls = []
+
+    def execute(func, *args, **kwargs):
+        calls.append((func, args, kwargs))
+        return func(*args, **kwargs)
+
+    monkeypatch.setattr(utils.patcher, "is_monkey_patched", lambda module: True)
+    monkeypatch.setattr(utils.tpool, "execute", execute)
+
+    assert run_blocking(sorted, [3, 1, 2], reverse=True) == [3, 2, 1]
+    assert calls == [(sorted, ([3, 1, 2],), {"reverse": True})]
+
+
+def test_run_blocking_runs_inline_when_not_patched(monkeypatch):
+    def execute(func, *args, **kwargs):
+        raise AssertionError("the thread pool needs a patched process")
+
+    monkeypatch.setattr(utils.patcher, "is_monkey_patched", lambda module: False)
+    monkeypatch.setattr(utils.tpool, "execute", execute)
+
+    assert run_blocking(sum, [1, 2, 3]) == 6
@@ -113,17 +113,6 @@ def test_timestamps(database):
     assert (datetime.utcnow() - u.last_seen).total_seconds() < 3
 
 
-def test_ping(database):
-    u = User(password="cat")
-    database.session.add(u)
-    database.session.commit()
-    time.sleep(2)
-    last_seen_before = u.last_seen
-    u.ping()
-
-    assert u.last_seen > last_seen_before
-
-
 def test_gravatar(app):
     u = User(email="john@example.com", password="cat")
     gravatar = u.gravatar()
@@ -137,3 +126,10 @@ def test_gravatar(app):
     assert "s=256" in gravatar_256
     assert "r=pg" in gravatar_pg
     assert "d=retro" in gravatar_retro
+
+
+def test_test_accounts_get_robohash_avatars(app):
+    test_user = User(email="stephen.little@example.com")
+    user = User(email="someone@example.com")
+    assert "d=robohash" in test_user.to_minimal()["gravatar"]
+    assert "d=identicon" in user.to_minimal()["gravatar"]
@@ -1,28 +1,184 @@
+import json
 import logging
+import time
+import uuid
 from app import socketio
+from app.utils import get_redis
 from flask_login import current_user
-from flask import request
+from flask import current_app, request
+from flask.json import JSONEncoder
+from flask_socketio import emit, join_room
+from werkzeug.exceptions import HTTPException
 
 logger = logging.getLogger(__name__)
 
-ACTIVE_CLIENTS = {}
+# user id -> sids of every device the user is connected from, on any worker,
+# scored by the last time their worker vouched for them
+ACTIVE_CLIENTS = "socketio:clients:%s"
+# user id -> bounded stream of the latest events sent to the user
+EVENTS = "socketio:events:%s"
+# user id -> seq of the latest event, kept after the stream has expired
+HEAD = "socketio:events:%s:head"
+
+# appends an event linked to the one before it, so a replay can tell the
+# events right after a client's last seq apart from a trimmed gap
+APPEND_EVENT = """
+local prev = redis.call("GET", KEYS[2]) or "0-0"
+local seq = redis.call(
+    "XADD", KEYS[1], "MAXLEN", "~", ARGV[1], "*", "data", ARGV[3], "prev", prev
+)
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+redis.call("SET", KEYS[2], seq, "EX", ARGV[4])
+return {seq, redis.call("ZCOUNT", KEYS[3], ARGV[5], "+inf")}
+"""
+
+# sid -> user id of the clients connected to this worker
+_local_clients = {}
+_heartbeat_started = False
+
+
+def user_room(user_id):
+    return f"user:{user_id}"
+
+
+def _stale_before():
+    """Sids last vouched for before this belong to a worker that is gone"""
+    return time.time() - current_app.config["SOCKETIO_CLIENT_TIMEOUT"].total_seconds()
+
+
+def get_client_sids(user_id):
+    sids = get_redis().zrangebyscore(ACTIVE_CLIENTS % user_id, _stale_before(), "+inf")
+    return {sid.decode() for sid in sids}
+
+
+def _heartbeat(app):
+    """
+    Refreshes the sids connected to this worker, a worker killed before its
+    clients disconnect stops refreshing them and they expire
+    """
+    with app.app_context():
+        timeout = app.config["SOCKETIO_CLIENT_TIMEOUT"]
+        while True:
+            socketio.sleep(app.config["SOCKETIO_CLIENT_HEARTBEAT"].total_seconds())
+            now = time.time()
+            try:
+                with get_redis().pipeline(transaction=False) as pipe:
+                    for sid, user_id in list(_local_clients.items()):
+                        pipe.zadd(ACTIVE_CLIENTS % user_id, {sid: now})
+                        pipe.expire(ACTIVE_CLIENTS % user_id, timeout)
+                    pipe.execute()
+            except Exception as e:
+                logger.exception("Failed to refresh active clients %s" % e)
+
+
+def _start_heartbeat():
+    global _heartbeat_started
+    if not _heartbeat_started:
+        _heartbeat_started = True
+        socketio.start_background_task(_heartbeat, current_app._get_current_object())
+
+
+def _seq_key(seq):
+    milliseconds, sequence = str(seq).split("-")
+    return int(milliseconds), int(sequence)
 
 
 def send_event_to_client(data, user_id):
-    client_sid = ACTIVE_CLIENTS.get(user_id)
-    # send update to client only if it is active
-    if client_sid:
-        try:
-            socketio.emit("message", {"data": data}, namespace="/", to=client_sid)
-        except Exception as e:
-            logger.exception("Failed to notify client of update %s" % e)
+    """
+    Appends the event to the user's stream, so devices that are offline can
+    catch up when they reconnect, and sends it to the devices that are online
+    """
+    config = current_app.config
+    # events carry model dumps, encode them the same way responses are so
+    # live and replayed events look alike
+    payload = json.dumps(data, cls=JSONEncoder)
+
+    try:
+        seq, active = get_redis().register_script(APPEND_EVENT)(
+            keys=[EVENTS % user_id, HEAD % user_id, ACTIVE_CLIENTS % user_id],
+            args=[
+                config["SOCKETIO_EVENT_BUFFER_SIZE"],
+                int(config["SOCKETIO_EVENT_BUFFER_TTL"].total_seconds()),
+                payload,
+                int(config["SOCKETIO_EVENT_HEAD_TTL"].total_seconds()),
+                _stale_before(),
+            ],
+        )
+
+        # send update to client only if it is active
+        if active:
+            # a single emit reaches every device in the user's room
+            socketio.emit(
+                "message",
+                {"data": json.loads(payload), "seq": seq.decode()},
+                namespace="/",
+                to=user_room(user_id),
+            )
+    except Exception as e:
+        # callers have already committed the change, failing them now would
+        # have clients retry something that was stored
+        logger.exception("Failed to notify client of update %s" % e)
+
+
+def get_head(user_id):
+    """The seq of the latest event sent to the user, 0-0 if there was none"""
+    redis = get_redis()
+    with redis.pipeline() as pipe:
+        pipe.get(HEAD % user_id)
+        pipe.xrevrange(EVENTS % user_id, count=1)
+        head, latest = pipe.execute()
+
+    # streams written before the head was kept only have their latest event
+    if head is None and latest:
+        head = latest[0][0]
+    return head.decode() if head else "0-0"
+
+
+def replay_events(user_id, last_seq, head):
+    """
+    Sends the events the client missed after ``last_seq`` up to ``head``. When
+    some of them are no longer buffered the client is asked to resync instead.
+    """
+    if _seq_key(last_seq) >= _seq_key(head):
+        return
+
+    missed = get_redis().xrange(EVENTS % user_id, min=f"({last_seq}", max=head)
+    if not missed or missed[0][1].get(b"prev", b"").decode() != last_seq:
+        emit("message", {"data": {"name": "resync"}})
+        return
+
+    for seq, fields in missed:
+        emit("message", {"data": json.loads(fields[b"data"]), "seq": seq.decode()})
 
 
 @socketio.event
-def connect():
+def connect(auth=None):
     if current_user.is_authenticated:
-        ACTIVE_CLIENTS.update({current_user.id: request.sid})
+        redis = get_redis()
+        join_room(user_room(current_user.id))
+        _start_heartbeat()
+        _local_clients[request.sid] = current_user.id
+
+        key = ACTIVE_CLIENTS % current_user.id
+        with redis.pipeline() as pipe:
+            pipe.zremrangebyscore(key, "-inf", f"({_stale_before()}")
+            pipe.zadd(key, {request.sid: time.time()})
+            pipe.expire(key, current_app.config["SOCKETIO_CLIENT_TIMEOUT"])
+            pipe.execute()
         logger.info("Client connected - id:%s" % current_user.id)
+
+        # events after head are sent live to the room joined above, clients
+        # drop anything at or before the last seq they have seen
+        head = get_head(current_user.id)
+
+        last_seq = (auth or {}).get("lastSeq")
+        if last_seq:
+            try:
+                replay_events(current_user.id, last_seq, head)
+            except ValueError:
+                emit("message", {"data": {"name": "resync"}})
+
+        emit("sequence", {"seq": head})
     else:
         return False
 
@@ -30,8 +186,43 @@ def connect():
 @socketio.event()
 def disconnect():
     if getattr(current_user, "id", None) is not None:
-        if current_user.id in ACTIVE_CLIENTS:
-            ACTIVE_CLIENTS.pop(current_user.id)
+        _local_clients.pop(request.sid, None)
+        get_redis().zrem(ACTIVE_CLIENTS % current_user.id, request.sid)
         logger.info("Client disconnected - id:%s" % current_user.id)
     else:
         logger.warning("Client disconnected - id:Unknown")
+
+
+@socketio.event
+def send_message(data):
+    """
+    Sends a message without the HTTP request overhead, the ack carries the
+    message with the id and timestamp the server assigned to it
+    """
+    if not current_user.is_authenticated:
+        return {"status": 401, "error": "Unauthorized"}
+
+    from app import db
+    from app.api.conversations import post_message
+    from app.models.conversation import Conversation
+
+    payload = dict(data or {})
+    try:
+        conversation_id = uuid.UUID(str(payload.pop("conversationId", None)))
+    except ValueError:
+        return {"status": 400, "error": "Invalid conversation id"}
+
+    try:
+        conversation = Conversation.query.get(conversation_id)
+        if not conversation:
+            return {"status": 400, "error": "Conversation does not exist"}
+
+        return {"status": 200, "message": post_message(conversation, payload)}
+    except HTTPException as err:
+        db.session.rollback()
+        return {"status": err.code, "error": err.description}
+    except Exception as e:
+        # the client is waiting for an ack either way
+        db.session.rollback()
+        logger.exception("Failed to send message %s" % e)
+        return {"status": 500, "error": "Internal Server Error"}
@@ -39,8 +39,9 @@ export class Conversations {
     }
   }
 
-  static sendMessage(conversationId: string, text: string) {
+  static sendMessage(conversationId: string, text: string, id: string) {
     return fetcher(`${ROOT}/${conversationId}`, 'POST', {
+      id: id,
       body: text,
     })
   }
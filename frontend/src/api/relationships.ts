@@ -7,6 +7,10 @@ export class Relationships {
     return fetcher(`${ROOT}/friends`, 'GET')
   }
 
+  static getSuggestions(limit = 10) {
+    return fetcher(`${ROOT}/suggestions?limit=${limit}`, 'GET')
+  }
+
   static addUser(username: string) {
     return fetcher(`${ROOT}/add/${username}`, 'POST')
   }
@@ -7,6 +7,13 @@ export class Search {
     return fetcher(`${ROOT_URL}?term=${term}`, 'GET')
   }
 
+  static suggest(term: string) {
+    return fetcher(
+      `${ROOT_URL}/suggest?term=${encodeURIComponent(term)}`,
+      'GET'
+    )
+  }
+
   static searchUser(username: string) {
     return fetcher(`${ROOT_URL}/user/${username}`, 'GET')
   }
@@ -5,7 +5,7 @@ import { isEmpty, orderBy } from 'lodash'
 import { Conversations, Relationships, Search as SearchService } from 'api'
 import { PageLoading } from 'components/common'
 import { useWebsockets } from 'hooks'
-import { ConversationSyncKind } from 'types/sockets'
+import { ConversationSyncKind, SocketEvent } from 'types/sockets'
 
 type LoadingState = {
   isAppLoading: boolean
@@ -156,9 +156,16 @@ export const ApplicationProvider: FC = ({ children }) => {
         const id = event?.id
         const kind = event?.kind
         if (!id || !kind) return
-        syncConversation(id, kind).catch(console.error)
+        syncConversation(id, kind, event).catch(console.error)
       } else if (event?.name === 'relationship') {
-        syncRelationships().catch(console.error)
+        if (event.user && event.kind) {
+          applyRelationship(event)
+        } else {
+          syncRelationships().catch(console.error)
+        }
+      } else if (event?.name === 'resync') {
+        // missed more events than the server keeps while offline
+        syncData(true).catch(console.error)
       }
       setEvents(newEvents)
     }
@@ -175,9 +182,38 @@ export const ApplicationProvider: FC = ({ children }) => {
     })
   }
 
+  const applyRelationship = ({ id, kind, state, user }: SocketEvent) => {
+    if (!user) return
+    const userId = Number(id)
+    const withoutUser = (users: FriendMinimal[]) =>
+      users.filter((other) => other.id !== userId)
+    const hasConversation = userConversations.some(
+      ({ senderId, recipientId }) =>
+        senderId === userId || recipientId === userId
+    )
+
+    setUserRelationships((prevState) => {
+      const userFriends = withoutUser(prevState.userFriends)
+      const userRequests = withoutUser(prevState.userRequests)
+      const otherUsers = withoutUser(prevState.otherUsers)
+
+      if (kind === 'UPDATE' && state === 'ACCEPTED') {
+        userFriends.push(user)
+      } else if (kind === 'UPDATE') {
+        userRequests.push(user)
+        if (hasConversation) otherUsers.push(user)
+      } else if (hasConversation) {
+        otherUsers.push(user)
+      }
+
+      return { userFriends, userRequests, otherUsers }
+    })
+  }
+
   const syncConversation = async (
     conversationId: string,
-    updateKind: ConversationSyncKind
+    updateKind: ConversationSyncKind,
+    event?: SocketEvent
   ) => {
     const request = async () =>
       Conversations.getConversation(conversationId, null, null)
@@ -185,14 +221,15 @@ export const ApplicationProvider: FC = ({ children }) => {
     if (updateKind === 'DELETE') {
       removeConversation(conversationId)
     } else if (updateKind === 'NEW') {
-      const conversation: Conversation = await requestSilent(request)
+      const conversation: Conversation =
+        event?.conversation ?? (await requestSilent(request))
       if (isEmpty(conversation)) return
       addNewConversation(conversation)
     } else if (updateKind === 'UPDATE') {
-      const conversation: Conversation = await requestSilent(request)
-      if (isEmpty(conversation)) return
-      const messagesNew = conversation.messages
-      if (isEmpty(messagesNew)) return
+      const messagesNew = event?.message
+        ? [event.message]
+        : ((await requestSilent(request)) as Conversation | null)?.messages
+      if (!messagesNew || isEmpty(messagesNew)) return
       const conversationsUpdate = [...userConversations]
       for (let i = 0; i < conversationsUpdate.length; i++) {
         if (conversationId === conversationsUpdate[i].id) {
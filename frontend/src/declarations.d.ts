@@ -4,3 +4,4 @@ declare module '*.svg'
 declare module '*.mp3'
 declare module 'highlight-words-core'
 declare module 'react-infinite-scroller'
+declare module 'uuid'
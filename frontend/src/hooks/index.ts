@@ -1,4 +1,4 @@
 export { useOnScreen } from './useOnScreen'
 export { useKeepScrollPosition } from './useKeepScreenPosition'
 export { useMessages } from './useMessages'
-export { useWebsockets } from './useWebsockets'
+export { useWebsockets, sendMessage } from './useWebsockets'
@@ -1,10 +1,66 @@
 import { useEffect, useState } from 'react'
 import { io } from 'socket.io-client'
 import { SocketEvent } from 'types/sockets'
+import { Message } from 'types/api'
+import { Conversations } from 'api'
 import { useUser } from 'contexts/userContext'
 
 const SERVER = process.env.APP_URL ?? ''
-const socket = io(SERVER, { autoConnect: false, withCredentials: true })
+
+// sequence of the last event received, sent on reconnect to replay the gap
+let lastSeq: string | null = null
+
+const seqKey = (seq: string) => seq.split('-').map(Number)
+
+const isAfterLastSeq = (seq: string) => {
+  if (lastSeq === null) return true
+  const [milliseconds, sequence] = seqKey(seq)
+  const [lastMilliseconds, lastSequence] = seqKey(lastSeq)
+  return (
+    milliseconds > lastMilliseconds ||
+    (milliseconds === lastMilliseconds && sequence > lastSequence)
+  )
+}
+
+const socket = io(SERVER, {
+  autoConnect: false,
+  withCredentials: true,
+  auth: (cb) => cb(lastSeq ? { lastSeq } : {}),
+})
+
+const SEND_MESSAGE_TIMEOUT = 10000
+
+type SendMessageAck =
+  | { status: 200; message: Message }
+  | { status: number; error: string | string[] }
+
+// sends over the socket when it is up, skipping a request per message. The
+// id is chosen here and kept for retries, so a send that timed out after the
+// server stored it is not stored twice.
+export const sendMessage = async (
+  conversationId: string,
+  body: string,
+  id: string
+): Promise<Message> => {
+  if (!socket.connected) {
+    const response = await Conversations.sendMessage(conversationId, body, id)
+    if (response.status !== 200) throw await response.json()
+    return response.json()
+  }
+
+  return new Promise((resolve, reject) => {
+    // the ack is lost if the connection drops before it arrives
+    socket.timeout(SEND_MESSAGE_TIMEOUT).emit(
+      'send_message',
+      { conversationId, id, body },
+      (error: Error | null, ack: SendMessageAck) => {
+        if (error) reject(error)
+        else if ('message' in ack) resolve(ack.message)
+        else reject(ack.error)
+      }
+    )
+  })
+}
 
 export const useWebsockets = () => {
   const [isConnected, setIsConnected] = useState(socket.connected)
@@ -35,10 +91,18 @@ export const useWebsockets = () => {
       setLastPing(new Date())
     })
 
+    socket.on('sequence', ({ seq }) => {
+      if (isAfterLastSeq(seq)) lastSeq = seq
+    })
+
     socket.on('message', (payload) => {
-      const { data } = payload
-      const newevents = [...events, data]
-      setEvents(newevents)
+      const { data, seq } = payload
+      if (seq) {
+        // already received live or in an earlier replay
+        if (!isAfterLastSeq(seq)) return
+        lastSeq = seq
+      }
+      setEvents((prevEvents) => [...prevEvents, data])
     })
 
     return () => {
@@ -46,6 +110,7 @@ export const useWebsockets = () => {
       socket.off('disconnect')
       socket.off('pong')
       socket.off('ping')
+      socket.off('sequence')
       socket.off('message')
     }
   }, [])
@@ -11,6 +11,7 @@ import {
   useColorModeValue,
 } from '@chakra-ui/react'
 import { FiChevronLeft, FiSend } from 'react-icons/fi'
+import { v4 as uuidv4 } from 'uuid'
 import { delay, getLastSeen } from 'utils'
 import { useUser } from 'contexts/userContext'
 import { MessageBubble } from './MessageBubble'
@@ -23,7 +24,7 @@ import {
 } from 'react'
 import { Conversations, Relationships } from 'api'
 import { useApplication } from 'contexts/applictionContext'
-import { useKeepScrollPosition, useMessages } from 'hooks'
+import { sendMessage, useKeepScrollPosition, useMessages } from 'hooks'
 import { ConversationMenu } from './Menu/ConversationMenu'
 
 export const UserConversation = ({
@@ -56,6 +57,8 @@ export const UserConversation = ({
     useMessages()
   const { containerRef } = useKeepScrollPosition([messages])
   const bottomRef = useRef<HTMLDivElement | null>(null)
+  // the id of the text being sent, reused when a failed send is retried
+  const pendingMessage = useRef<{ text: string; id: string } | null>(null)
 
   useEffect(() => {
     readUnreadMessages().catch(console.error)
@@ -78,28 +81,29 @@ export const UserConversation = ({
     setIsSending(true)
 
     try {
-      let response
       if (conversation.id) {
-        response = await Conversations.sendMessage(conversation.id, text)
+        const pending =
+          pendingMessage.current && pendingMessage.current.text === text
+            ? pendingMessage.current
+            : { text, id: uuidv4() }
+        pendingMessage.current = pending
+        const message = await sendMessage(conversation.id, text, pending.id)
+        pendingMessage.current = null
+        addMessagesToActiveConversation([message])
+        setText('')
       } else if (user.id) {
-        response = await Conversations.createConversation({
+        const response = await Conversations.createConversation({
           recipientId: user.id,
           messageBody: text,
         })
-      }
-      if (response?.status === 200) {
-        const data = await response.json()
-        if (conversation.id) {
-          const msgs = [data]
-          addMessagesToActiveConversation(msgs)
-        } else if (conversation.id === null) {
+        if (response.status === 200) {
+          const data = await response.json()
           addNewConversation(data)
           setActiveConversation(data.id)
+          setText('')
+        } else {
+          await handleFailedMessage()
         }
-
-        setText('')
-      } else {
-        await handleFailedMessage()
       }
     } catch (error) {
       console.error(error)
@@ -86,10 +86,11 @@ export const UserSearch = ({
 
   const search = async (term: string) => {
     try {
-      const response = await SearchService.searchAll(term)
+      // typeahead, cheap enough to run on every pause in typing
+      const response = await SearchService.suggest(term)
       const data = await response.json()
       if (response.status === 200) {
-        const userResults: FriendMinimal[] = [...data.users.results]
+        const userResults: FriendMinimal[] = [...data]
         setResults(userResults)
       } else {
         setError(data.message ?? 'Something went wrong. Try again later')
@@ -141,7 +142,7 @@ export const UserSearch = ({
   const debouncedSearch = useCallback(
     debounce((value) => {
       search(value).catch(console.error)
-    }, 500),
+    }, 150),
     []
   )
 
@@ -1,9 +1,18 @@
+import { Conversation, FriendMinimal, Message } from 'types/api'
+
 export type ConversationSyncKind = 'NEW' | 'UPDATE' | 'DELETE'
 
-type EventName = 'conversation' | 'relationship'
+type EventName = 'conversation' | 'relationship' | 'resync'
+
+export type RelationshipState = 'ACCEPTED' | 'REQUESTEE'
 
 export type SocketEvent = {
   name: EventName
   id: string
   kind: ConversationSyncKind
+  // changed data, older events without it fall back to a refetch
+  conversation?: Conversation
+  message?: Message
+  user?: FriendMinimal
+  state?: RelationshipState
 }